@@ -0,0 +1,125 @@
+"""Micro-benchmarks of ``DBLogWriter`` line splitting.
+
+Feeds typical and pathological output through the writer into a buffer that
+discards the lines, so only the splitting is measured, and compares it with
+the previous ``buffer += msg; split("\\n", 1)`` writer::
+
+    python -m benchmarks.bench_capture --scale 1
+
+Reported per case: seconds, megabytes per second, lines produced and the
+peak memory held while writing, measured in a second ``tracemalloc`` run so
+it does not slow down the timed one.
+"""
+import argparse
+import tracemalloc
+
+from benchmarks.common import Timer, report, setup_django
+
+
+class NullBuffer:
+    def __init__(self):
+        self.count = 0
+
+    def add(self, line, truncated=0):
+        self.count += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ConcatWriter:
+    """The writer as it was before line splitting became linear."""
+
+    def __init__(self, log_buffer):
+        self.buffer = ""
+        self.log_buffer = log_buffer
+
+    def _emit(self, line):
+        from celery_tasklog.models import TaskLogLine
+
+        self.log_buffer.add(TaskLogLine(task_id="bench", stream="stdout", message=line))
+
+    def write(self, msg):
+        self.buffer += msg
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            if line:
+                self._emit(line)
+
+    def close(self):
+        if self.buffer:
+            self._emit(self.buffer)
+            self.buffer = ""
+
+
+def cases(scale):
+    lines = 100_000 * scale
+    yield "print_lines", lambda: ((f"line {i} processed", "\n") for i in range(lines))
+    # A whole report dumped with a single write.
+    yield "one_big_write", lambda: ["".join(f"row {i}\n" for i in range(lines))]
+    # A progress bar redrawn with carriage returns.
+    yield "progress_bar", lambda: (f"\r{i * 100 // lines:3d}% |{'#' * (i * 40 // lines):<40}|" for i in range(lines))
+    # A blob without newlines written in 64 KiB chunks.
+    yield "unterminated_blob", lambda: ("x" * 65536 for _ in range(32 * scale))
+
+
+def feed(writer, chunks):
+    written = 0
+    for chunk in chunks:
+        if isinstance(chunk, tuple):
+            for part in chunk:
+                writer.write(part)
+                written += len(part)
+        else:
+            writer.write(chunk)
+            written += len(chunk)
+    writer.close()
+    return written
+
+
+def run(scale, include_old, max_line_length):
+    from celery_tasklog.buffers import LimitedLogBuffer
+    from celery_tasklog.tasks import DBLogWriter
+
+    writers = {"linear": lambda sink: DBLogWriter(
+        "bench", "stdout", LimitedLogBuffer(sink, "bench", max_line_length=max_line_length, max_bytes=0)
+    )}
+    if include_old:
+        writers["concat"] = ConcatWriter
+
+    results = []
+    for case, make_chunks in cases(scale):
+        for name, make_writer in writers.items():
+            sink = NullBuffer()
+            with Timer() as timer:
+                written = feed(make_writer(sink), make_chunks())
+            tracemalloc.start()
+            feed(make_writer(NullBuffer()), make_chunks())
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append({
+                "case": case,
+                "writer": name,
+                "seconds": round(timer.elapsed, 4),
+                "mb_per_sec": round(written / timer.elapsed / 1e6, 1),
+                "lines": sink.count,
+                "peak_kib": peak // 1024,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--max-line-length", type=int, default=65536)
+    parser.add_argument("--no-old", action="store_true", help="skip the previous writer (slow on big writes)")
+    args = parser.parse_args()
+    setup_django()
+    report("capture", run(args.scale, not args.no_old, args.max_line_length))
+
+
+if __name__ == "__main__":
+    main()
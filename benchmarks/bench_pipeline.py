@@ -0,0 +1,323 @@
+"""End-to-end benchmark suite of the capture → persist → publish → stream path.
+
+Runs every stage against a temporary SQLite database and Redis, and reports:
+
+- ``capture``: lines per second printed through ``capture_output``, per
+  batch size, with publishing off;
+- ``persist``: rows per second written by ``save_log_lines``, per storage
+  backend;
+- ``publish``: latency of publishing one flushed batch, per transport;
+- ``sse``: latency from ``print`` in a task to the line arriving at each
+  connected SSE client (p50/p99) and the memory held per client, at each
+  number of viewers.
+
+::
+
+    python -m benchmarks.bench_pipeline --fake-redis --output results.json
+    python -m benchmarks.bench_pipeline --fake-redis --compare results.json
+
+Redis is the one at ``CELERY_BROKER_URL`` unless ``--fake-redis`` is given.
+Results are printed as JSON lines like the other benchmarks; ``--output``
+also writes them, with the environment they were measured in, to a JSON
+file that a later run can ``--compare`` against. The comparison lists every
+metric that got worse by more than ``--tolerance`` and exits with status 1
+if there is one.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+from benchmarks.common import Timer, report, setup_django
+
+STAGES = ("capture", "persist", "publish", "sse")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def latency_stats(seconds):
+    return {
+        "p50_ms": round(statistics.median(seconds) * 1000, 3),
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 3),
+    }
+
+
+def bench_capture(lines, batch_sizes):
+    from celery_tasklog.tasks import capture_output
+
+    results = []
+    for batch_size in batch_sizes:
+        with Timer() as timer:
+            with capture_output(f"bench-capture-{batch_size}", batch_size=batch_size, flush_interval=1000):
+                for i in range(lines):
+                    print(f"[{i:08d}] processed record batch in 12 ms")
+        results.append({
+            "stage": "capture",
+            "batch_size": batch_size,
+            "lines": lines,
+            "lines_per_sec": round(lines / timer.elapsed),
+        })
+    return results
+
+
+def bench_persist(rows, batch_size):
+    from django.test import override_settings
+
+    from celery_tasklog.buffers import save_log_lines
+    from celery_tasklog.models import TaskLogLine
+
+    results = []
+    for storage in ("lines", "segments"):
+        task_id = f"bench-persist-{storage}"
+        lines = [TaskLogLine(task_id=task_id, stream="stdout", message=f"row {i} of the persist stage") for i in range(rows)]
+        with override_settings(CELERY_TASKLOG_STORAGE=storage):
+            with Timer() as timer:
+                for start in range(0, rows, batch_size):
+                    save_log_lines(lines[start:start + batch_size])
+        results.append({
+            "stage": "persist",
+            "storage": storage,
+            "batch_size": batch_size,
+            "rows": rows,
+            "rows_per_sec": round(rows / timer.elapsed),
+        })
+    return results
+
+
+def bench_publish(batches, batch_size):
+    from django.test import override_settings
+    from django.utils import timezone
+
+    from celery_tasklog.models import TaskLogLine
+    from celery_tasklog.publishing import publish_log_lines
+
+    results = []
+    now = timezone.now()
+    for transport in ("pubsub", "stream"):
+        latencies = []
+        with override_settings(CELERY_TASKLOG_PUBLISH=True, CELERY_TASKLOG_TRANSPORT=transport):
+            for n in range(batches):
+                batch = [
+                    TaskLogLine(id=n * batch_size + i + 1, task_id="bench-publish", stream="stdout",
+                                message=f"line {i}", timestamp=now)
+                    for i in range(batch_size)
+                ]
+                start = time.perf_counter()
+                publish_log_lines(batch)
+                latencies.append(time.perf_counter() - start)
+        results.append({
+            "stage": "publish",
+            "transport": transport,
+            "batch_size": batch_size,
+            "batches": batches,
+            **latency_stats(latencies),
+        })
+    return results
+
+
+async def watch(task_id, received, ready):
+    """One SSE client: record the arrival time of every measured line."""
+    from django.test import RequestFactory
+
+    from celery_tasklog.api_views import task_log_stream
+
+    request = RequestFactory().get(f"/tasklog/sse/task/{task_id}/", {"tail": 1})
+    response = await task_log_stream(request, task_id)
+    stream = response.streaming_content
+    connected = False
+    try:
+        async for chunk in stream:
+            arrived = time.perf_counter()
+            if not connected:
+                connected = True
+                ready.release()
+            for frame in chunk.decode().split("\n\n"):
+                if not frame.startswith("data: ") and "\ndata: " not in frame:
+                    continue
+                data = json.loads(frame.rpartition("data: ")[2])
+                if data.get("type") != "new_log":
+                    continue
+                kind, _, sent = data["message"].partition(" ")
+                if kind == "stop":
+                    return
+                received.append((kind, arrived - float(sent)))
+    finally:
+        await stream.aclose()
+
+
+def produce(task_id, lines, interval, warmed_up):
+    """A task printing timestamped lines, run in its own thread."""
+    from django.db import connection
+
+    from celery_tasklog.tasks import capture_output
+
+    try:
+        with capture_output(task_id, batch_size=1):
+            # Pub/sub only reaches subscribed clients, so keep printing
+            # until every client has received a line.
+            while not warmed_up.is_set():
+                print(f"warmup {time.perf_counter()!r}")
+                time.sleep(0.01)
+            for _ in range(lines):
+                print(f"line {time.perf_counter()!r}")
+                time.sleep(interval)
+            print(f"stop {time.perf_counter()!r}")
+    finally:
+        connection.close()
+
+
+async def measure_viewers(viewers, lines, interval):
+    task_id = f"bench-sse-{viewers}"
+    received = [[] for _ in range(viewers)]
+    ready = asyncio.Semaphore(0)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    clients = [asyncio.create_task(watch(task_id, received[i], ready)) for i in range(viewers)]
+    for _ in range(viewers):
+        await ready.acquire()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    memory = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+    warmed_up = threading.Event()
+    producer = threading.Thread(target=produce, args=(task_id, lines, interval, warmed_up))
+    producer.start()
+    while not all(received):
+        await asyncio.sleep(0.01)
+    warmed_up.set()
+    try:
+        await asyncio.gather(*clients)
+    finally:
+        await asyncio.to_thread(producer.join)
+
+    latencies = [latency for client in received for kind, latency in client if kind == "line"]
+    return {
+        "stage": "sse",
+        "viewers": viewers,
+        "lines": lines,
+        "deliveries": len(latencies),
+        **latency_stats(latencies),
+        "kib_per_client": round(memory / viewers / 1024, 1),
+    }
+
+
+def bench_sse(viewer_counts, lines, interval):
+    from django.test import override_settings
+
+    results = []
+    with override_settings(CELERY_TASKLOG_PUBLISH=True):
+        for viewers in viewer_counts:
+            results.append(asyncio.run(measure_viewers(viewers, lines, interval)))
+    return results
+
+
+def environment(args):
+    import django
+
+    from django.conf import settings
+    from django.db import connection
+
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "platform": platform.platform(),
+        "database": f"{connection.vendor} {connection.Database.sqlite_version}" if connection.vendor == "sqlite" else connection.vendor,
+        "redis": "fakeredis" if args.fake_redis else settings.CELERY_BROKER_URL,
+    }
+
+
+# Direction of each metric: higher is better for rates, lower for the rest.
+HIGHER_IS_BETTER = ("lines_per_sec", "rows_per_sec")
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "kib_per_client")
+PARAMETERS = ("stage", "batch_size", "storage", "transport", "viewers")
+
+
+def compare(baseline, results, tolerance):
+    """Metrics of ``results`` worse than ``baseline`` by more than ``tolerance``."""
+    def key(result):
+        return tuple(result.get(name) for name in PARAMETERS)
+
+    previous = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            if not old.get(metric) or metric not in result:
+                continue
+            change = (result[metric] - old[metric]) / old[metric]
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append({
+                    **{name: result[name] for name in PARAMETERS if name in result},
+                    "metric": metric,
+                    "baseline": old[metric],
+                    "current": result[metric],
+                    "worse_by": f"{change:.0%}",
+                })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--lines", type=int, default=20000, help="lines printed by the capture stage")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--rows", type=int, default=50000, help="rows written by the persist stage")
+    parser.add_argument("--publish-batches", type=int, default=500)
+    parser.add_argument("--publish-batch-size", type=int, default=100)
+    parser.add_argument("--viewers", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--sse-lines", type=int, default=200, help="lines measured per viewer count")
+    parser.add_argument("--interval", type=float, default=0.005, help="seconds between measured lines")
+    parser.add_argument("--fake-redis", action="store_true")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change, e.g. 0.2")
+    args = parser.parse_args(argv)
+
+    setup_django()
+    if args.fake_redis:
+        import fakeredis
+
+        import celery_tasklog.api_views as api_views
+        import celery_tasklog.publishing as publishing
+
+        server = fakeredis.FakeServer()
+        publishing.redis_client = fakeredis.FakeRedis(server=server)
+        api_views.redis_client = fakeredis.FakeAsyncRedis(server=server)
+
+    results = []
+    if "capture" in args.stages:
+        results += bench_capture(args.lines, args.batch_sizes)
+    if "persist" in args.stages:
+        results += bench_persist(args.rows, max(args.batch_sizes))
+    if "publish" in args.stages:
+        results += bench_publish(args.publish_batches, args.publish_batch_size)
+    if "sse" in args.stages:
+        results += bench_sse(args.viewers, args.sse_lines, args.interval)
+    report("pipeline", results)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"environment": environment(args), "results": results}, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(json.load(baseline), results, args.tolerance)
+        report("regression", regressions)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
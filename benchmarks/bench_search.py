@@ -0,0 +1,57 @@
+"""Latency of the log search with the FTS5 index against a plain scan.
+
+Loads synthetic lines spread over many tasks and times the same queries
+through each search backend::
+
+    python -m benchmarks.bench_search --lines 200000
+"""
+import argparse
+
+from benchmarks.bench_storage import synthetic_lines
+from benchmarks.common import Timer, report, setup_django
+
+QUERIES = ["warehouse retrying", "[00001234]", "OK", "no such text"]
+
+
+def run(count, tasks, repeat):
+    from django.test import override_settings
+
+    from celery_tasklog.models import TaskLogLine
+    from celery_tasklog.search import search_lines
+
+    lines = [
+        TaskLogLine(task_id=f"bench-search-{i % tasks}", stream=stream, message=message)
+        for i, (stream, message) in enumerate(synthetic_lines(count))
+    ]
+    TaskLogLine.objects.bulk_create(lines, batch_size=1000)
+
+    results = []
+    for backend in ("fts5", "scan"):
+        with override_settings(CELERY_TASKLOG_SEARCH_BACKEND=backend):
+            for query in QUERIES:
+                with Timer() as timer:
+                    for _ in range(repeat):
+                        hits = search_lines(query, limit=50)
+                results.append({
+                    "backend": backend,
+                    "lines": count,
+                    "query": query,
+                    "hits": len(hits),
+                    "ms": round(timer.elapsed * 1000 / repeat, 2),
+                })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    report("search", run(args.lines, args.tasks, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Connection-setup latency of the SSE view under simultaneous connects.
+
+Opens N task log streams at once and measures the time until each receives
+its first stored line, once per size of the SSE read thread pool (``0`` is
+Django's single thread-sensitive thread)::
+
+    python -m benchmarks.bench_sse_connect --clients 200 --threads 0 8 32
+
+Live lines come from the Redis at ``CELERY_BROKER_URL``; pass
+``--fake-redis`` to use an in-process fakeredis server instead.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.common import Timer, report, setup_django
+
+
+def create_tasks(count, lines_per_task):
+    from celery_tasklog.models import TaskLogLine
+
+    TaskLogLine.objects.bulk_create(
+        [
+            TaskLogLine(task_id=f"bench-sse-{i}", stream="stdout", message=f"line {n}")
+            for i in range(count)
+            for n in range(lines_per_task)
+        ],
+        batch_size=1000,
+    )
+
+
+async def connect(task_id, tail):
+    from django.test import RequestFactory
+
+    from celery_tasklog.api_views import task_log_stream
+
+    start = time.perf_counter()
+    request = RequestFactory().get(f"/tasklog/sse/task/{task_id}/", {"tail": tail} if tail else {})
+    response = await task_log_stream(request, task_id)
+    stream = response.streaming_content
+    try:
+        async for chunk in stream:
+            if b'"new_log"' in chunk:
+                break
+    finally:
+        await stream.aclose()
+    return time.perf_counter() - start
+
+
+async def connect_all(clients, tail):
+    return await asyncio.gather(*(connect(f"bench-sse-{i}", tail) for i in range(clients)))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(clients, thread_counts, lines_per_task, tail):
+    from django.test import override_settings
+
+    results = []
+    for threads in thread_counts:
+        with override_settings(CELERY_TASKLOG_SSE_READ_THREADS=threads):
+            with Timer() as timer:
+                latencies = asyncio.run(connect_all(clients, tail))
+        results.append({
+            "clients": clients,
+            "read_threads": threads,
+            "lines_per_task": lines_per_task,
+            "p50_ms": round(statistics.median(latencies) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "max_ms": round(max(latencies) * 1000, 1),
+            "total_s": round(timer.elapsed, 2),
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--threads", type=int, nargs="+", default=[0, 8, 32])
+    parser.add_argument("--lines", type=int, default=200, help="stored lines per task")
+    parser.add_argument("--tail", type=int, default=0, help="replay only the last N lines")
+    parser.add_argument("--fake-redis", action="store_true")
+    args = parser.parse_args(argv)
+
+    setup_django()
+    if args.fake_redis:
+        import fakeredis
+
+        import celery_tasklog.api_views as api_views
+
+        api_views.redis_client = fakeredis.FakeAsyncRedis()
+    create_tasks(args.clients, args.lines)
+    report("sse_connect", run(args.clients, args.threads, args.lines, args.tail))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare the line-per-row and compressed segment storage backends.
+
+Writes the same synthetic task log through each backend in flush-sized
+batches, then reports table size, insert throughput and the throughput of a
+chunked full read (as done by the SSE backfill)::
+
+    python -m benchmarks.bench_storage --lines 100000
+"""
+import argparse
+import random
+
+from benchmarks.common import Timer, report, setup_django, table_bytes
+
+
+def synthetic_lines(count):
+    words = ["Processing", "batch", "rows", "loaded", "from", "warehouse", "in", "ms", "OK", "retrying"]
+    rng = random.Random(42)
+    for i in range(count):
+        stream = "stderr" if rng.random() < 0.05 else "stdout"
+        message = f"[{i:08d}] " + " ".join(rng.choice(words) for _ in range(rng.randint(4, 14)))
+        yield stream, message
+
+
+def run(backends, count, batch_size, chunk_size):
+    from celery_tasklog.models import TaskLogLine, TaskLogSegment
+    from celery_tasklog.storage import LineStorage, SegmentStorage
+
+    results = []
+    for name in backends:
+        if name == "lines":
+            storage, table = LineStorage(), TaskLogLine._meta.db_table
+        else:
+            storage, table = SegmentStorage(codec=name.split(":", 1)[1]), TaskLogSegment._meta.db_table
+        task_id = f"bench-{name}"
+        lines = [TaskLogLine(task_id=task_id, stream=s, message=m) for s, m in synthetic_lines(count)]
+        payload = sum(len(line.message) for line in lines)
+
+        with Timer() as write:
+            for start in range(0, count, batch_size):
+                storage.save(lines[start:start + batch_size])
+
+        read_count = 0
+        with Timer() as read:
+            after = 0
+            while True:
+                chunk = storage.lines(task_id, after=after, limit=chunk_size)
+                read_count += len(chunk)
+                if len(chunk) < chunk_size:
+                    break
+                after = chunk[-1].id
+        assert read_count == count, (name, read_count)
+
+        with Timer() as tail:
+            storage.lines(task_id, limit=100, reverse=True)
+
+        size = table_bytes(table)
+        results.append({
+            "backend": name,
+            "lines": count,
+            "payload_bytes": payload,
+            "table_bytes": size,
+            "bytes_per_line": round(size / count, 1) if size is not None else None,
+            "insert_lines_per_sec": round(count / write.elapsed),
+            "read_lines_per_sec": round(count / read.elapsed),
+            "tail_100_ms": round(tail.elapsed * 1000, 2),
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from celery_tasklog.storage import zstandard
+
+    backends = ["lines", "segments:zlib", "segments:none"]
+    if zstandard is not None:
+        backends.append("segments:zstd")
+    report("storage", run(backends, args.lines, args.batch_size, args.chunk_size))
+
+
+if __name__ == "__main__":
+    main()
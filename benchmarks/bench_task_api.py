@@ -0,0 +1,90 @@
+"""Query count and latency of the task list and detail endpoints.
+
+Creates N tasks (with and without ``django-celery-results`` rows) and checks
+that the number of queries per request does not grow with N::
+
+    python -m benchmarks.bench_task_api --tasks 10 50 200
+"""
+import argparse
+import json
+
+from benchmarks.common import Timer, report, setup_django
+
+
+def create_tasks(start, count, lines_per_task, with_results):
+    from django_celery_results.models import TaskResult
+
+    from celery_tasklog.models import TaskLogLine
+    from celery_tasklog.summaries import update_summaries
+
+    for i in range(start, start + count):
+        task_id = f"bench-task-{i}"
+        lines = TaskLogLine.objects.bulk_create(
+            [TaskLogLine(task_id=task_id, stream="stdout", message=f"line {n}") for n in range(lines_per_task)]
+        )
+        update_summaries(lines)
+        if with_results:
+            TaskResult.objects.create(
+                task_id=task_id, task_name="bench", status="SUCCESS", result=json.dumps({"ok": True})
+            )
+
+
+def measure(client, url, repeat=5):
+    from django.db import connection
+
+    queries = []
+
+    def count(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    # The test client resets ``connection.queries`` on every request, so
+    # count statements with an execute wrapper instead.
+    with connection.execute_wrapper(count):
+        client.get(url)
+    with Timer() as timer:
+        for _ in range(repeat):
+            client.get(url)
+    return len(queries), round(timer.elapsed / repeat * 1000, 2)
+
+
+def run(sizes, lines_per_task):
+    from django.test import Client
+
+    from celery_tasklog.models import TaskLogLine
+    from django_celery_results.models import TaskResult
+
+    client = Client()
+    results = []
+    for with_results in (True, False):
+        TaskLogLine.objects.all().delete()
+        TaskResult.objects.all().delete()
+        created = 0
+        for size in sorted(sizes):
+            create_tasks(created, size - created, lines_per_task, with_results)
+            created = size
+            list_queries, list_ms = measure(client, "/tasklog/api/tasks/")
+            detail_queries, detail_ms = measure(client, "/tasklog/api/tasks/bench-task-0/")
+            results.append({
+                "tasks": size,
+                "task_results": with_results,
+                "list_queries": list_queries,
+                "list_ms": list_ms,
+                "detail_queries": detail_queries,
+                "detail_ms": detail_ms,
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--lines-per-task", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    report("task_api", run(args.tasks, args.lines_per_task))
+
+
+if __name__ == "__main__":
+    main()
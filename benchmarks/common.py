@@ -0,0 +1,86 @@
+"""Shared set-up for the benchmark scripts.
+
+Benchmarks run against a throw-away SQLite database file so that table sizes
+can be measured, using the same way of loading the app as ``tests/``.
+"""
+import importlib.util
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+PACKAGE_PATH = ROOT / "celery_tasklog" / "src" / "celery_tasklog"
+
+
+def setup_django(db_path=None):
+    """Configure Django with a fresh SQLite database and run migrations.
+
+    Returns the path of the database file.
+    """
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    if "celery_tasklog" not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            "celery_tasklog",
+            PACKAGE_PATH / "__init__.py",
+            submodule_search_locations=[str(PACKAGE_PATH)],
+        )
+        package = importlib.util.module_from_spec(spec)
+        sys.modules["celery_tasklog"] = package
+        spec.loader.exec_module(package)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djproject.settings")
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    db_path = db_path or os.path.join(tempfile.mkdtemp(prefix="tasklog-bench-"), "bench.sqlite3")
+    settings.DATABASES["default"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": db_path,
+    }
+    # Benchmarks measure storage, not Redis, unless they opt back in.
+    settings.CELERY_TASKLOG_PUBLISH = False
+    settings.LOGGING["root"]["level"] = "WARNING"
+    settings.LOGGING["loggers"]["celery_tasklog"]["level"] = "WARNING"
+    django.setup()
+    call_command("migrate", verbosity=0)
+    return db_path
+
+
+def table_bytes(table):
+    """Bytes used by ``table`` and its indexes in the SQLite database.
+
+    Returns ``None`` when SQLite was built without the ``dbstat`` table.
+    """
+    from django.db import connection
+    from django.db.utils import OperationalError
+
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = %s "
+                "OR name IN (SELECT name FROM sqlite_master WHERE tbl_name = %s AND type = 'index')",
+                [table, table],
+            )
+        except OperationalError:
+            return None
+        return cursor.fetchone()[0]
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def report(benchmark, results):
+    """Print ``results`` as one JSON object per line for machine consumption."""
+    for result in results:
+        print(json.dumps({"benchmark": benchmark, **result}))
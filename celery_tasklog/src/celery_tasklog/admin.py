@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import TaskLogLine
+from .models import TaskLogLine, TaskLogSegment, TaskLogSummary
+from .search import get_search_backend
 
 
 @admin.register(TaskLogLine)
@@ -7,3 +8,25 @@ class TaskLogLineAdmin(admin.ModelAdmin):
     list_display = ('task_id', 'timestamp', 'stream', 'message')
     list_filter = ('stream',)
     search_fields = ('task_id', 'message')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Match messages through the search index instead of the unindexed
+        # LIKE scan the admin would generate.
+        if not search_term:
+            return queryset, False
+        matches = get_search_backend().filter(queryset, search_term)
+        return matches | queryset.filter(task_id=search_term), False
+
+
+@admin.register(TaskLogSegment)
+class TaskLogSegmentAdmin(admin.ModelAdmin):
+    list_display = ('task_id', 'first_line', 'last_line', 'line_count', 'codec', 'size', 'last_timestamp')
+    list_filter = ('codec',)
+    search_fields = ('task_id',)
+    exclude = ('data',)
+
+
+@admin.register(TaskLogSummary)
+class TaskLogSummaryAdmin(admin.ModelAdmin):
+    list_display = ('task_id', 'line_count', 'stdout_count', 'stderr_count', 'bytes', 'last_timestamp')
+    search_fields = ('task_id',)
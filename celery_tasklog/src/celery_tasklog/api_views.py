@@ -1,20 +1,32 @@
 from rest_framework import generics
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
-from django.http import StreamingHttpResponse
+from rest_framework.views import APIView
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from celery import current_app
 from django_celery_results.models import TaskResult
 from django.conf import settings
-from asgiref.sync import sync_to_async
-from .models import TaskLogLine
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from .serializers import (
+    LogSearchHitSerializer,
     TaskListSerializer,
     TaskDetailSerializer,
     TaskLogLineSerializer,
 )
+from .search import context_lines, search_lines
+from .storage import get_storage
+from .summaries import get_summaries
+from . import metrics, publishing
+from .multiplex import TaskMultiplexer, parse_task_ids
+from .publishing import control_channel
+from .sse import LogFilter, coalesce, format_batch, format_event, log_events, parse_cursor, parse_level
 import json
 import logging
+import re
+import uuid
 import redis.asyncio as aioredis
 
 # Import the global SSE connections dictionary and lock from signals.py
@@ -26,115 +38,128 @@ logger = logging.getLogger(__name__)
 redis_client = aioredis.from_url(settings.CELERY_BROKER_URL)
 
 
+def _decode_result(task_result):
+    """The stored result (or ``PROGRESS`` meta) of a ``TaskResult``."""
+    if task_result.result is None:
+        return None
+    try:
+        return json.loads(task_result.result)
+    except (TypeError, ValueError):
+        return task_result.result
+
+
+def _progress(*candidates):
+    for candidate in candidates:
+        if isinstance(candidate, dict) and candidate.get('progress') is not None:
+            return candidate['progress']
+    return None
+
+
+def _task_results(task_ids):
+    """``TaskResult`` rows for ``task_ids`` keyed by task id, in one query."""
+    try:
+        return {r.task_id: r for r in TaskResult.objects.filter(task_id__in=list(task_ids))}
+    except Exception as e:
+        logger.warning(f"Task results unavailable: {e}")
+        return {}
+
+
+def _task_data(task_id, task_result=None, summary=None):
+    summary = summary or {}
+    data = {
+        'task_id': task_id,
+        'task_name': 'Unknown',
+        'status': 'UNKNOWN',
+        'started_at': None,
+        'completed_at': None,
+        'progress': None,
+        'log_count': summary.get('log_count') or 0,
+        'last_log_at': summary.get('last_log_at'),
+    }
+    if task_result is not None:
+        data.update({
+            'task_name': task_result.task_name or 'Unknown',
+            'status': task_result.status,
+            'started_at': task_result.date_created,
+            'completed_at': task_result.date_done,
+            'progress': _progress(_decode_result(task_result), task_result.meta),
+        })
+    return data
+
+
 class TaskListView(generics.ListAPIView):
-    """API endpoint to list all tasks with their status"""
+    """API endpoint to list all tasks with their status
+
+    The 50 most recent tasks are read with one ``TaskResult`` query and their
+    log metrics with one ``TaskLogSummary`` query, so the number of queries
+    does not depend on the number of tasks. Without ``django-celery-results``
+    data the tasks that logged most recently are listed instead.
+    """
     serializer_class = TaskListSerializer
+    page_size = 50
     
     def get_queryset(self):
         # Get tasks from django-celery-results
         return TaskResult.objects.all().order_by('-date_created')
     
     def list(self, request, *args, **kwargs):
-        # Get tasks from Celery result backend
-        tasks = []
-        
-        # Get from django-celery-results if available
         try:
-            task_results = TaskResult.objects.all().order_by('-date_created')[:50]  # Limit to recent 50 tasks
-            
-            for task_result in task_results:
-                # Get progress from meta if available
-                progress = None
-                if task_result.meta and isinstance(task_result.meta, dict):
-                    progress = task_result.meta.get('progress')
-                
-                task_data = {
-                    'task_id': task_result.task_id,
-                    'task_name': task_result.task_name or 'Unknown',
-                    'status': task_result.status,
-                    'started_at': task_result.date_created,
-                    'completed_at': task_result.date_done,
-                    'progress': progress
-                }
-                tasks.append(task_data)
+            task_results = list(self.get_queryset()[:self.page_size])
         except Exception as e:
-            # Fallback: get from TaskLogLine if django-celery-results not available
-            task_ids = TaskLogLine.objects.values_list('task_id', flat=True).distinct()[:50]
-            for task_id in task_ids:
-                # Try to get task info from Celery
-                try:
-                    result = current_app.AsyncResult(task_id)
-                    progress = None
-                    if result.info and isinstance(result.info, dict):
-                        progress = result.info.get('progress')
-                    
-                    task_data = {
-                        'task_id': task_id,
-                        'task_name': result.name or 'Unknown',
-                        'status': result.status,
-                        'started_at': None,
-                        'completed_at': None,
-                        'progress': progress
-                    }
-                    tasks.append(task_data)
-                except Exception:
-                    # Basic task info from logs only
-                    task_data = {
-                        'task_id': task_id,
-                        'task_name': 'Unknown',
-                        'status': 'UNKNOWN',
-                        'started_at': None,
-                        'completed_at': None,
-                        'progress': None
-                    }
-                    tasks.append(task_data)
-        
+            logger.warning(f"Task results unavailable, listing tasks from logs: {e}")
+            task_results = []
+
+        if task_results:
+            summaries = get_summaries(task_ids=[r.task_id for r in task_results])
+            tasks = [
+                _task_data(r.task_id, r, summaries.get(r.task_id)) for r in task_results
+            ]
+        else:
+            # Fallback: tasks that have logs, most recent first
+            summaries = get_summaries(limit=self.page_size)
+            results = _task_results(summaries) if summaries else {}
+            tasks = [
+                _task_data(task_id, results.get(task_id), summary)
+                for task_id, summary in summaries.items()
+            ]
+
         serializer = self.get_serializer(tasks, many=True)
         return Response(serializer.data)
 
 
 class TaskDetailView(generics.RetrieveAPIView):
-    """API endpoint to get task details including logs"""
+    """API endpoint to get task details including logs
+
+    Status and timestamps come from ``TaskResult``; the Celery result backend
+    is only asked when there is no ``TaskResult`` for the task.
+    """
     serializer_class = TaskDetailSerializer
     lookup_field = 'task_id'
     
     def retrieve(self, request, task_id, *args, **kwargs):
-        # Get task info from Celery
-        try:
-            result = current_app.AsyncResult(task_id)
-            progress = None
-            if result.info and isinstance(result.info, dict):
-                progress = result.info.get('progress')
-            
-            # Try to get from django-celery-results for timestamps
-            task_result = None
+        storage = get_storage()
+        task_result = _task_results([task_id]).get(task_id)
+        summary = get_summaries(task_ids=[task_id]).get(task_id)
+        task_data = _task_data(task_id, task_result, summary)
+        task_data['result'] = None
+        if task_result is not None:
+            if task_result.status == 'SUCCESS':
+                task_data['result'] = _decode_result(task_result)
+        else:
+            # Last resort: ask the Celery result backend directly
             try:
-                task_result = TaskResult.objects.get(task_id=task_id)
-            except TaskResult.DoesNotExist:
-                pass
-            
-            task_data = {
-                'task_id': task_id,
-                'task_name': result.name or (task_result.task_name if task_result else 'Unknown'),
-                'status': result.status,
-                'started_at': task_result.date_created if task_result else None,
-                'completed_at': task_result.date_done if task_result else None,
-                'progress': progress,
-                'result': result.result if result.successful() else None
-            }
-        except Exception:
-            task_data = {
-                'task_id': task_id,
-                'task_name': 'Unknown',
-                'status': 'UNKNOWN',
-                'started_at': None,
-                'completed_at': None,
-                'progress': None,
-                'result': None
-            }
-        
+                result = current_app.AsyncResult(task_id)
+                task_data.update({
+                    'task_name': result.name or 'Unknown',
+                    'status': result.status,
+                    'progress': _progress(result.info),
+                    'result': result.result if result.successful() else None,
+                })
+            except Exception as e:
+                logger.warning(f"Could not get result of task {task_id}: {e}")
+
         # Get logs (last 1000 lines)
-        logs = TaskLogLine.objects.filter(task_id=task_id).order_by('-id')[:1000]
+        logs = storage.lines(task_id, limit=1000, reverse=True)
         logs = list(reversed(logs))  # Reverse to get chronological order
         
         logger.info(f"Retrieved {len(logs)} log lines for task {task_id}")
@@ -144,7 +169,6 @@ class TaskDetailView(generics.RetrieveAPIView):
         # Important: Always use the serializer to properly format the logs for JSON
         serializer = TaskLogLineSerializer(logs, many=True)
         task_data['logs'] = serializer.data
-        task_data['log_count'] = len(logs)
         
         serializer = self.get_serializer(task_data)
         return Response(serializer.data)
@@ -152,11 +176,179 @@ class TaskDetailView(generics.RetrieveAPIView):
 
 
 
+def _int_param(request, name, default=None, minimum=0):
+    value = request.query_params.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValidationError({name: "Must be an integer."})
+    if value < minimum:
+        raise ValidationError({name: f"Must be at least {minimum}."})
+    return value
+
+
+def _level_param(request, name='level'):
+    try:
+        return parse_level(request.query_params.get(name))
+    except ValueError:
+        raise ValidationError({name: "Must be a logging level name or number."})
+
+
+class TaskLogListView(generics.ListAPIView):
+    """API endpoint to page through the log lines of a task by line id.
+
+    ``?after=<id>`` returns the lines following a line id and
+    ``?before=<id>`` the lines preceding it (the newest lines when neither is
+    given), ``?limit=`` sets the page size, ``?stream=`` keeps only
+    ``stdout``, ``stderr`` or ``log`` lines and ``?level=`` only ``logging``
+    records of at least that level (e.g. ``error``). Every page is a single range scan on the
+    ``(task_id, id)`` index (or the segment index), however deep into the
+    log it is.
+    """
+    serializer_class = TaskLogLineSerializer
+    default_limit = 100
+    max_limit = 1000
+
+    def list(self, request, task_id, *args, **kwargs):
+        after = _int_param(request, 'after')
+        before = _int_param(request, 'before')
+        limit = min(_int_param(request, 'limit', self.default_limit, minimum=1), self.max_limit)
+        stream = request.query_params.get('stream')
+        min_level = _level_param(request)
+
+        # Fetch one extra row to find out whether another page exists.
+        storage = get_storage()
+        if after is not None:
+            logs = storage.lines(
+                task_id, after=after, before=before, limit=limit + 1, stream=stream, min_level=min_level
+            )
+            has_more = len(logs) > limit
+            logs = logs[:limit]
+        else:
+            logs = storage.lines(
+                task_id, before=before, limit=limit + 1, reverse=True, stream=stream, min_level=min_level
+            )
+            has_more = len(logs) > limit
+            logs = list(reversed(logs[:limit]))
+
+        next_url = previous_url = None
+        if logs:
+            forward = after is not None
+            if not forward or has_more:
+                next_url = self._page_url(request, after=logs[-1].id)
+            if forward or has_more:
+                previous_url = self._page_url(request, before=logs[0].id)
+        elif before is not None:
+            next_url = self._page_url(request, after=before - 1)
+
+        return Response({
+            'task_id': task_id,
+            'next': next_url,
+            'previous': previous_url,
+            'results': self.get_serializer(logs, many=True).data,
+        })
+
+    def _page_url(self, request, **cursor):
+        params = request.query_params.copy()
+        params.pop('after', None)
+        params.pop('before', None)
+        for key, value in cursor.items():
+            params[key] = value
+        return request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+
+
+def _datetime_param(request, name):
+    value = request.query_params.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None and parse_date(value) is not None:
+            parsed = parse_datetime(f"{value}T00:00:00")
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: "Must be an ISO 8601 date or datetime."})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class LogSearchView(generics.ListAPIView):
+    """API endpoint to search log lines across tasks.
+
+    ``?q=`` is matched as a case-insensitive substring through the search
+    index (see ``search.py``); ``?task_id=``, ``?stream=`` and ``?since=``
+    (ISO date or datetime) narrow the search. Hits come newest first with
+    ``?context=`` lines of their task before and after them, and ``next``
+    continues after the last hit of the page.
+    """
+    serializer_class = LogSearchHitSerializer
+    default_limit = 50
+    max_limit = 200
+    default_context = 2
+    max_context = 20
+
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '')
+        if not query:
+            raise ValidationError({'q': "This parameter is required."})
+        before = _int_param(request, 'before')
+        limit = min(_int_param(request, 'limit', self.default_limit, minimum=1), self.max_limit)
+        context = min(_int_param(request, 'context', self.default_context), self.max_context)
+
+        hits = search_lines(
+            query,
+            task_id=request.query_params.get('task_id'),
+            stream=request.query_params.get('stream'),
+            since=_datetime_param(request, 'since'),
+            before=before,
+            limit=limit + 1,
+        )
+        has_more = len(hits) > limit
+        hits = hits[:limit]
+        for hit in hits:
+            hit.context_before, hit.context_after = context_lines(hit, context) if context else ([], [])
+
+        next_url = None
+        if has_more:
+            params = request.query_params.copy()
+            params['before'] = hits[-1].id
+            next_url = request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+
+        return Response({
+            'query': query,
+            'next': next_url,
+            'results': self.get_serializer(hits, many=True).data,
+        })
+
+
 @csrf_exempt
 async def task_log_stream(request, task_id):
-    """SSE endpoint for streaming task logs using async Redis pub/sub."""
+    """SSE endpoint for streaming task logs from Redis pub/sub or streams.
 
-    logger.info(f"SSE connection requested for task {task_id}")
+    Every log event carries its line id as SSE event id. A reconnecting
+    ``EventSource`` sends it back as ``Last-Event-ID`` (``?after=<id>`` does
+    the same for other clients) and only lines after it are replayed.
+    ``?tail=<n>`` limits the replay to the last ``n`` stored lines.
+    ``?stream=stdout|stderr|log``, ``?level=<logging level>`` and
+    ``?grep=<regex>`` filter the replayed and the live lines server-side;
+    ``tail`` then counts matching lines.
+
+    Lines that are ready together are written in one chunk. With
+    ``?batch=1`` they are also sent as a single ``logs`` event holding an
+    array of lines instead of one event per line. A keepalive is only sent
+    when nothing else was sent for a while.
+    """
+
+    cursor = parse_cursor(request.headers.get("Last-Event-ID") or request.GET.get("after"))
+    try:
+        tail, log_filter, batch = _stream_options(request)
+    except ValueError as exc:
+        return HttpResponseBadRequest(str(exc))
+    logger.info(f"SSE connection requested for task {task_id} after line {cursor}")
 
     async def event_stream():
         logger.info(f"Starting SSE stream for task {task_id}")
@@ -164,44 +356,52 @@ async def task_log_stream(request, task_id):
         # Initial connected message
         yield f"data: {json.dumps({'type': 'connected', 'task_id': task_id})}\n\n"
 
-        # Subscribe to Redis channel for this task
-        channel_name = f"tasklog:{task_id}"
-        pubsub = redis_client.pubsub()
-        await pubsub.subscribe(channel_name)
+        # Existing lines from the database followed by live lines from Redis,
+        # using the transport selected by CELERY_TASKLOG_TRANSPORT.
+        events = log_events(redis_client, task_id, after=cursor, tail=tail, log_filter=log_filter)
+        async for chunk in _render(events, batch):
+            yield chunk
 
-        # Send existing logs first. Querying the database from an async
-        # context requires using ``sync_to_async`` to avoid Django's
-        # SynchronousOnlyOperation error.
-        existing_logs = await sync_to_async(list)(
-            TaskLogLine.objects.filter(task_id=task_id).order_by("id")
-        )
-        for log in existing_logs:
-            message = {
-                'type': 'new_log',
-                'id': log.id,
-                'timestamp': log.timestamp.isoformat(),
-                'stream': log.stream,
-                'message': log.message,
-                'task_id': log.task_id,
-            }
-            yield f"data: {json.dumps(message)}\n\n"
+    return _sse_response(event_stream())
+
+
+def _stream_options(request):
+    """``tail``, ``LogFilter`` and batch flag of an SSE request.
+
+    Raises ``ValueError`` for invalid parameters.
+    """
+    tail = parse_cursor(request.GET.get("tail")) or None
+    stream = request.GET.get("stream") or None
+    if stream not in (None, "stdout", "stderr", "log"):
+        raise ValueError("stream must be 'stdout', 'stderr' or 'log'")
+    min_level = parse_level(request.GET.get("level"))
+    try:
+        log_filter = LogFilter(stream=stream, grep=request.GET.get("grep"), min_level=min_level)
+    except re.error as exc:
+        raise ValueError(f"Invalid grep pattern: {exc}")
+    return tail, log_filter or None, request.GET.get("batch") in ("1", "true")
 
-        try:
-            while True:
-                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=5)
-                if message:
-                    try:
-                        data = json.loads(message["data"])
-                        yield f"data: {json.dumps(data)}\n\n"
-                    except Exception as exc:
-                        logger.error("Error processing pubsub message: %s", exc)
-                else:
-                    yield f"data: {json.dumps({'type': 'keepalive'})}\n\n"
-        finally:
-            await pubsub.unsubscribe(channel_name)
-            await pubsub.close()
 
-    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+async def _render(events, batch, with_id=True):
+    """Coalesce an event source and format it as SSE chunks."""
+    batches = coalesce(events)
+    metrics.add("sse_connections", 1)
+    try:
+        async for messages in batches:
+            if messages is None:
+                yield f"data: {json.dumps({'type': 'keepalive'})}\n\n"
+            elif batch:
+                yield format_batch(messages, with_id)
+            else:
+                yield "".join(format_event(message, with_id) for message in messages)
+    finally:
+        # Release the Redis subscriptions as soon as the client goes away.
+        metrics.add("sse_connections", -1)
+        await batches.aclose()
+
+
+def _sse_response(stream):
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
     response["Cache-Control"] = "no-cache"
     response["X-Accel-Buffering"] = "no"
     response["Access-Control-Allow-Origin"] = "*"
@@ -209,6 +409,63 @@ async def task_log_stream(request, task_id):
     return response
 
 
+@csrf_exempt
+async def tasks_log_stream(request):
+    """SSE endpoint streaming the logs of several tasks over one connection.
+
+    ``?ids=a,b,c`` names the tasks (``b:<id>`` resumes task ``b`` after a
+    line id) and ``?running=1`` adds every running task, following tasks as
+    they start and stop. ``tail``, ``stream``, ``grep`` and ``batch`` work
+    as for a single task. Events carry their ``task_id`` but no SSE event
+    id, since one id cannot resume several tasks. The ``connected`` event
+    holds a ``session`` for the control API
+    (``POST /tasklog/api/streams/<session>/``), which adds or removes tasks
+    without reconnecting; changes are announced by ``subscriptions`` events.
+    """
+    try:
+        tail, log_filter, batch = _stream_options(request)
+    except ValueError as exc:
+        return HttpResponseBadRequest(str(exc))
+    tasks = parse_task_ids(request.GET.get("ids"))
+    follow_running = request.GET.get("running") in ("1", "true")
+    if not tasks and not follow_running:
+        return HttpResponseBadRequest("Pass ids=<task ids> or running=1")
+
+    async def event_stream():
+        multiplexer = TaskMultiplexer(
+            redis_client, uuid.uuid4().hex, tail=tail, log_filter=log_filter, follow_running=follow_running
+        )
+        try:
+            await multiplexer.start(tasks)
+            yield f"data: {json.dumps({'type': 'connected', 'session': multiplexer.session, 'task_ids': multiplexer.task_ids})}\n\n"
+            async for chunk in _render(multiplexer.events(), batch, with_id=False):
+                yield chunk
+        finally:
+            await multiplexer.close()
+
+    return _sse_response(event_stream())
+
+
+class StreamControlView(APIView):
+    """Add tasks to or remove them from an open multi-task SSE stream.
+
+    Accepts ``{"add": [...], "remove": [...]}`` and publishes it on the
+    stream's control channel; 404 when no stream with that session is open.
+    """
+
+    def post(self, request, session):
+        change = {}
+        for key in ("add", "remove"):
+            task_ids = request.data.get(key, [])
+            if not isinstance(task_ids, list) or not all(isinstance(t, str) for t in task_ids):
+                raise ValidationError({key: "Must be a list of task ids."})
+            change[key] = task_ids
+        receivers = publishing.redis_client.publish(control_channel(session), json.dumps(change))
+        if not receivers:
+            return Response({'detail': "No open stream with this session."}, status=404)
+        return Response({'session': session, **change}, status=202)
+
+
 # Signal handler is now in signals.py
 
 
@@ -0,0 +1,295 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from django.db import connection
+
+from . import metrics
+from .conf import get_setting
+from .models import TaskLogLine
+from .publishing import publish_log_lines
+from .storage import get_storage
+from .summaries import update_summaries
+
+logger = logging.getLogger(__name__)
+
+
+def save_log_lines(lines):
+    """Persist a batch of unsaved ``TaskLogLine`` instances and publish them.
+
+    The lines are written by the configured storage backend, added to the
+    task summaries and, since the backends do not send ``post_save``,
+    published to Redis here with a single pipelined round trip.
+    """
+    if lines:
+        started = metrics.start_timer()
+        get_storage().save(lines)
+        update_summaries(lines)
+        metrics.observe_since("flush_seconds", started)
+        metrics.observe("flush_lines", len(lines))
+        metrics.increment("lines_written_total", len(lines))
+        publish_log_lines(lines)
+    return lines
+
+
+class LogBuffer:
+    """Collect captured log lines and write them to the database in batches.
+
+    Pending lines are written with a single ``bulk_create`` once
+    ``batch_size`` lines have accumulated or the oldest pending line has
+    waited ``flush_interval`` milliseconds, and always on ``flush()``,
+    ``close()`` or when leaving the buffer as a context manager.
+
+    With ``batch_size`` of ``1`` every line is written as soon as it is
+    added, like the original writer.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        if batch_size is None:
+            batch_size = get_setting("BATCH_SIZE")
+        if flush_interval is None:
+            flush_interval = get_setting("FLUSH_INTERVAL")
+        self.batch_size = max(int(batch_size), 1)
+        self.flush_interval = flush_interval / 1000.0
+        self.pending = []
+        self._oldest = None
+
+    def add(self, line: TaskLogLine):
+        if not self.pending:
+            self._oldest = time.monotonic()
+        self.pending.append(line)
+        if (
+            len(self.pending) >= self.batch_size
+            or time.monotonic() - self._oldest >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        lines, self.pending = self.pending, []
+        self._oldest = None
+        save_log_lines(lines)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class LimitedLogBuffer:
+    """Apply a task's output limits in front of another buffer.
+
+    Messages longer than ``max_line_length`` characters are cut and marked
+    with the number of characters removed; once ``max_bytes`` (UTF-8) have
+    been buffered for the task further lines are dropped. Limits of ``0``
+    disable them. The first dropped line adds a notice to the log and
+    ``close()`` adds a summary of everything truncated or dropped, both as
+    ``log`` lines with the counts in ``extra``.
+    """
+
+    def __init__(self, log_buffer, task_id, max_line_length=None, max_bytes=None):
+        if max_line_length is None:
+            max_line_length = get_setting("MAX_LINE_LENGTH")
+        if max_bytes is None:
+            max_bytes = get_setting("MAX_TASK_BYTES")
+        self.log_buffer = log_buffer
+        self.task_id = task_id
+        self.max_line_length = max(int(max_line_length), 0)
+        self.max_bytes = max(int(max_bytes), 0)
+        self.written_bytes = 0
+        self.truncated_lines = 0
+        self.truncated_chars = 0
+        self.dropped_lines = 0
+        self.dropped_bytes = 0
+        # Lines may come from file descriptor reader threads as well.
+        self._lock = threading.Lock()
+
+    def add(self, line: TaskLogLine, truncated=0):
+        """Buffer ``line`` within the limits.
+
+        ``truncated`` counts characters the caller already cut from the
+        message, e.g. a writer that stopped collecting an overlong line.
+        """
+        with self._lock:
+            self._add(line, truncated)
+
+    def _add(self, line, truncated):
+        message = line.message
+        if self.max_line_length and len(message) > self.max_line_length:
+            truncated += len(message) - self.max_line_length
+            message = message[:self.max_line_length]
+        if truncated:
+            metrics.increment("lines_truncated_total")
+            self.truncated_lines += 1
+            self.truncated_chars += truncated
+            line.message = message = f"{message} [truncated {truncated} characters]"
+        if self.max_bytes:
+            size = len(message) if message.isascii() else len(message.encode(errors="replace"))
+            if self.written_bytes + size > self.max_bytes:
+                if not self.dropped_lines:
+                    self._notice(
+                        f"Task output reached its limit of {self.max_bytes} bytes; further lines are dropped",
+                        max_bytes=self.max_bytes,
+                    )
+                metrics.increment("lines_dropped_total", reason="quota")
+                self.dropped_lines += 1
+                self.dropped_bytes += size
+                return
+            self.written_bytes += size
+        self.log_buffer.add(line)
+
+    def _notice(self, message, **extra):
+        # Notices bypass the limits they report on.
+        self.log_buffer.add(TaskLogLine(
+            task_id=self.task_id,
+            stream="log",
+            message=message,
+            level=logging.WARNING,
+            logger=__name__,
+            extra=extra,
+        ))
+
+    def flush(self, *args, **kwargs):
+        self.log_buffer.flush(*args, **kwargs)
+
+    def close(self):
+        if self.truncated_lines or self.dropped_lines:
+            self._notice(
+                f"Task output limits: truncated {self.truncated_lines} lines "
+                f"({self.truncated_chars} characters), dropped {self.dropped_lines} lines "
+                f"({self.dropped_bytes} bytes)",
+                truncated_lines=self.truncated_lines,
+                truncated_chars=self.truncated_chars,
+                dropped_lines=self.dropped_lines,
+                dropped_bytes=self.dropped_bytes,
+            )
+        self.log_buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class BackgroundLogBuffer(LogBuffer):
+    """Hand captured lines to a writer thread so task code never waits on the DB.
+
+    Lines are appended to a bounded in-process queue that a daemon thread
+    drains in batches of up to ``batch_size``. When the queue holds
+    ``max_queue`` lines the ``policy`` decides what happens to new ones:
+
+    * ``"block"`` waits until the writer has made room,
+    * ``"drop_oldest"`` discards the oldest queued line,
+    * ``"drop"`` discards the new line.
+
+    Discarded lines are counted in ``dropped``. ``flush()`` asks the writer
+    to persist everything queued without waiting for it, so
+    ``print(..., flush=True)`` in a task stays cheap; ``flush(wait=True)``
+    blocks until it is written. ``close()`` drains the queue and stops the
+    thread.
+    """
+
+    POLICIES = ("block", "drop_oldest", "drop")
+
+    def __init__(self, batch_size=None, flush_interval=None, max_queue=None, policy=None):
+        super().__init__(batch_size=batch_size, flush_interval=flush_interval)
+        if max_queue is None:
+            max_queue = get_setting("QUEUE_SIZE")
+        if policy is None:
+            policy = get_setting("BACKPRESSURE")
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy!r}, expected one of {self.POLICIES}")
+        self.max_queue = max(int(max_queue), 1)
+        self.policy = policy
+        self.dropped = 0
+        self._queue = deque()
+        self._unfinished = 0
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="celery-tasklog-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, line: TaskLogLine):
+        with self._cond:
+            if self._closed:
+                raise ValueError("add() on a closed BackgroundLogBuffer")
+            while len(self._queue) >= self.max_queue:
+                if self.policy != "block":
+                    metrics.increment("lines_dropped_total", reason="backpressure")
+                if self.policy == "drop":
+                    self.dropped += 1
+                    return
+                if self.policy == "drop_oldest":
+                    self._queue.popleft()
+                    self._unfinished -= 1
+                    self.dropped += 1
+                    break
+                self._cond.wait()
+            self._queue.append(line)
+            self._unfinished += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+
+    def flush(self, wait=False):
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while wait and self._unfinished and self._thread.is_alive():
+                self._cond.wait()
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        if self.dropped:
+            logger.warning("Dropped %d log lines because the tasklog queue was full", self.dropped)
+
+    def _next_batch(self):
+        """Wait until a batch is due and take it off the queue."""
+        deadline = None
+        while not (self._closed or self._flush_requested or len(self._queue) >= self.batch_size):
+            if not self._queue:
+                deadline = None
+                self._cond.wait()
+                continue
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.batch_size))]
+        # Producers blocked on a full queue can continue now.
+        self._cond.notify_all()
+        return batch
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    batch = self._next_batch()
+                    if not batch and self._closed:
+                        return
+                try:
+                    save_log_lines(batch)
+                except Exception:
+                    logger.exception("Failed to write %d log lines", len(batch))
+                with self._cond:
+                    self._unfinished -= len(batch)
+                    if not self._queue:
+                        self._flush_requested = False
+                    self._cond.notify_all()
+        finally:
+            # The writer thread owns its own database connection.
+            connection.close()
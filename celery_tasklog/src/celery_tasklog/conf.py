@@ -0,0 +1,102 @@
+from django.conf import settings
+
+# Default values for the ``CELERY_TASKLOG_*`` settings. Projects override any
+# of these by defining the prefixed name in their Django settings module.
+DEFAULTS = {
+    "ENABLED": True,
+    "MAX_LINES": 1000,
+    "RETENTION_DAYS": 30,
+    # Number of lines collected before they are written with one INSERT.
+    # ``1`` keeps the original line-by-line behaviour.
+    "BATCH_SIZE": 1,
+    # Maximum time in milliseconds a captured line may wait in the buffer.
+    "FLUSH_INTERVAL": 1000,
+    # Persist captured lines from a background thread instead of the task.
+    "BACKGROUND": False,
+    # Route sys.stdout/sys.stderr through proxies installed once per process
+    # to the writers of the task running in the current thread, greenlet or
+    # asyncio task, instead of swapping them for every task. Needed for the
+    # thread, gevent and eventlet pools.
+    "CONTEXT_STREAMS": False,
+    # Also redirect file descriptors 1 and 2, capturing subprocesses, C
+    # extensions and os.write; for pools running one task per process.
+    "CAPTURE_FDS": False,
+    # Directory of worker-local spool files that captured lines are appended
+    # to, to be shipped to the database by a thread (None writes directly).
+    "SPOOL_DIR": None,
+    # When spooled lines are fsynced: "always", "flush" or "never".
+    "SPOOL_FSYNC": "flush",
+    # Size at which a spool segment file is rolled over.
+    "SPOOL_SEGMENT_BYTES": 16 * 1024 * 1024,
+    # Most lines the shipper inserts at once.
+    "SPOOL_BATCH_SIZE": 5000,
+    # Maximum number of lines waiting for the background writer.
+    "QUEUE_SIZE": 10000,
+    # What to do when that queue is full: "block", "drop_oldest" or "drop".
+    "BACKPRESSURE": "block",
+    # Characters kept of a single captured line (the rest is cut and counted)
+    # and UTF-8 bytes of output stored per task (later lines are dropped and
+    # counted). 0 disables either limit.
+    "MAX_LINE_LENGTH": 65536,
+    "MAX_TASK_BYTES": 0,
+    # Also store ``logging`` records emitted during a captured task, with
+    # their level, logger name and extra fields as columns.
+    "CAPTURE_LOGGING": True,
+    # Publish captured lines to Redis for live streaming.
+    "PUBLISH": True,
+    # Also publish task status/progress events (from Celery signals and
+    # TerminalLoggingTask.update_state) on the channel of the task's logs.
+    "STATUS_EVENTS": True,
+    # How live lines travel from workers to SSE clients: "pubsub" or
+    # "stream" (Redis Streams with resumable cursors).
+    "TRANSPORT": "pubsub",
+    # Approximate number of recent lines kept per task in its Redis stream.
+    "STREAM_MAXLEN": 10000,
+    # Seconds a task's Redis stream is kept after its last line.
+    "STREAM_TTL": 86400,
+    # Rows fetched per query when replaying stored lines to an SSE client.
+    "BACKFILL_CHUNK_SIZE": 1000,
+    # Threads (each with its own database connection) reading stored lines
+    # for SSE clients; 0 reads on Django's single thread-sensitive thread.
+    "SSE_READ_THREADS": 8,
+    # Share one Redis pub/sub connection between all SSE clients of a process.
+    "SHARED_PUBSUB": True,
+    # Messages buffered per SSE client on the shared connection.
+    "HUB_QUEUE_SIZE": 1000,
+    # What to do with a client whose buffer is full: "disconnect" (it
+    # resumes from its last event id) or "drop_oldest".
+    "SLOW_CONSUMER": "disconnect",
+    # Batching of SSE output: at most this many lines per write (and per
+    # "logs" event for clients that ask for ?batch=1), and how long (ms) a
+    # batch keeps filling while a task is printing faster than it is sent.
+    "SSE_BATCH_LINES": 500,
+    "SSE_BATCH_WINDOW": 50,
+    # Most tasks one multi-task SSE connection may watch.
+    "SSE_MAX_TASKS": 50,
+    # Where captured lines are stored: "lines" (one TaskLogLine row per line)
+    # or "segments" (compressed TaskLogSegment rows).
+    "STORAGE": "lines",
+    # Limits of a single segment.
+    "SEGMENT_LINES": 1000,
+    "SEGMENT_BYTES": 64 * 1024,
+    # Segment compression: "zlib", "zstd" (needs the zstandard package) or
+    # "none".
+    "COMPRESSION": "zlib",
+    # Rows deleted per statement when pruning old logs.
+    "PRUNE_BATCH_SIZE": 5000,
+    # Where pipeline metrics go: None (disabled), "registry" (in-process),
+    # "prometheus" (in-process, served at metrics/), "statsd" or the dotted
+    # path of a sink class.
+    "METRICS": None,
+    "METRICS_PREFIX": "celery_tasklog",
+    # host:port receiving statsd packets.
+    "STATSD_ADDRESS": "localhost:8125",
+    # Search index used by the log search API: "auto" (FTS5 on SQLite, the
+    # trigram index on PostgreSQL) or "scan" (plain icontains).
+    "SEARCH_BACKEND": "auto",
+}
+
+
+def get_setting(name):
+    """Return ``CELERY_TASKLOG_<name>`` from settings or its default."""
+    return getattr(settings, f"CELERY_TASKLOG_{name}", DEFAULTS[name])
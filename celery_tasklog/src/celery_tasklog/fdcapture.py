@@ -0,0 +1,93 @@
+"""Capture of a file descriptor, not just the Python stream object on it.
+
+``capture_output`` replaces ``sys.stdout``/``sys.stderr``, which misses
+output written straight to file descriptors 1 and 2: subprocesses that
+inherit them, C extensions and ``os.write``. ``FDCapture`` points the
+descriptor at a pipe with ``dup2`` and a reader thread decodes whatever
+arrives, chunk by chunk into one reused buffer, and writes it to a
+``DBLogWriter``. Nothing is accumulated in memory, however much a
+subprocess prints.
+
+The descriptors belong to the whole process, so this is only meant for
+workers running one task at a time (the prefork and solo pools). POSIX
+only.
+"""
+import codecs
+import ctypes
+import os
+import select
+import threading
+
+
+def flush_c_streams():
+    """Flush C stdio buffers, so ``printf`` output goes to the current fd."""
+    try:
+        ctypes.CDLL(None).fflush(None)
+    except (OSError, AttributeError):  # pragma: no cover - no C library
+        pass
+
+
+class FDCapture:
+    """Send everything written to ``fd`` to ``writer`` until ``stop()``.
+
+    ``writer`` receives text from the reader thread, so it must write to a
+    thread-safe buffer (``capture_output`` uses the background buffer).
+    """
+
+    def __init__(self, fd, writer, chunk_size=65536, encoding="utf-8"):
+        self.fd = fd
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._saved = None
+        self._read_fd = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        flush_c_streams()
+        self._read_fd, write_fd = os.pipe()
+        self._saved = os.dup(self.fd)
+        os.dup2(write_fd, self.fd)
+        os.close(write_fd)
+        self._thread = threading.Thread(target=self._run, name=f"celery-tasklog-fd{self.fd}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Restore the descriptor and write out everything read so far."""
+        if self._thread is None:
+            return
+        flush_c_streams()
+        # Closes our write end of the pipe: the reader sees end of file once
+        # no subprocess holds a copy of it any more.
+        os.dup2(self._saved, self.fd)
+        os.close(self._saved)
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        os.close(self._read_fd)
+        self.writer.write(self.decoder.decode(b"", final=True))
+        self.writer.close()
+
+    def _run(self):
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        while True:
+            # Poll, so that a background process keeping the pipe open
+            # cannot stop the capture from ending with the task.
+            timeout = 0 if self._stopping.is_set() else 0.1
+            if not select.select([self._read_fd], [], [], timeout)[0]:
+                if self._stopping.is_set():
+                    return
+                continue
+            size = os.readv(self._read_fd, [buffer])
+            if not size:
+                return
+            self.writer.write(self.decoder.decode(view[:size]))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
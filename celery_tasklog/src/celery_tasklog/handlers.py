@@ -0,0 +1,74 @@
+"""Capture of ``logging`` records into the task log.
+
+``TaskLogHandler`` turns records logged while ``capture_output`` is active
+into ``TaskLogLine`` rows with stream ``"log"``, keeping the level, logger
+name and ``extra`` fields as columns instead of formatting them into text.
+The records go into the same buffer as the captured stdout/stderr lines,
+so they are batched, stored and published with them and keep their order.
+"""
+import logging
+from contextvars import ContextVar
+
+from .models import TaskLogLine
+
+# ``(task_id, log_buffer)`` of the capture active in the current context.
+active_capture = ContextVar("tasklog_active_capture", default=None)
+
+# Attributes every ``LogRecord`` has; anything else was passed as ``extra``.
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_JSON_TYPES = (str, int, float, bool, type(None), list, dict)
+
+
+def record_extra(record):
+    """The ``extra`` fields of ``record``, or ``None`` when there are none.
+
+    Values JSON cannot represent are stored as their ``repr``.
+    """
+    extra = {
+        key: value if isinstance(value, _JSON_TYPES) else repr(value)
+        for key, value in vars(record).items()
+        if key not in RECORD_ATTRIBUTES
+    }
+    return extra or None
+
+
+class TaskLogHandler(logging.Handler):
+    """Logging handler writing records of the running task to its log.
+
+    Records emitted outside ``capture_output`` are ignored, so one handler
+    can stay installed on the root logger of a worker.
+    """
+
+    def emit(self, record):
+        capture = active_capture.get()
+        if capture is None:
+            return
+        task_id, log_buffer = capture
+        try:
+            message = record.getMessage()
+            if record.exc_info:
+                message = f"{message}\n{self.formatException(record.exc_info)}"
+            elif record.exc_text:
+                message = f"{message}\n{record.exc_text}"
+            log_buffer.add(TaskLogLine(
+                task_id=task_id,
+                stream="log",
+                message=message,
+                level=record.levelno,
+                logger=record.name[:255],
+                extra=record_extra(record),
+            ))
+        except Exception:
+            self.handleError(record)
+
+
+def install_handler(logger=None):
+    """Add a ``TaskLogHandler`` to ``logger`` (the root logger) once."""
+    logger = logger or logging.getLogger()
+    for handler in logger.handlers:
+        if isinstance(handler, TaskLogHandler):
+            return handler
+    handler = TaskLogHandler()
+    logger.addHandler(handler)
+    return handler
@@ -0,0 +1,190 @@
+"""Redis pub/sub subscriptions for the SSE views.
+
+By default every ASGI process keeps a single pattern subscription to
+``tasklog:*`` and fans incoming messages out to one bounded ``asyncio.Queue``
+per connected client, so the number of Redis connections does not grow with
+the number of viewers. Setting ``CELERY_TASKLOG_SHARED_PUBSUB = False`` falls
+back to one dedicated pub/sub connection per client.
+"""
+import asyncio
+import logging
+import weakref
+
+from . import metrics
+from .conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PATTERN = "tasklog:*"
+
+
+class SlowConsumer(Exception):
+    """Raised to a subscriber whose queue overflowed and that must reconnect."""
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class Subscription:
+    """A client's view of one channel on the shared hub."""
+
+    POLICIES = ("disconnect", "drop_oldest")
+
+    def __init__(self, hub, channel, maxsize, policy):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown slow consumer policy {policy!r}, expected one of {self.POLICIES}")
+        self.hub = hub
+        self.channel = channel
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.overflowed = False
+
+    def deliver(self, data):
+        """Queue ``data`` without blocking the hub's reader."""
+        if self.overflowed:
+            return
+        if self.queue.full():
+            if self.policy == "disconnect":
+                # The client resumes from its last event id after
+                # reconnecting, which is cheaper than an unbounded queue.
+                self.overflowed = True
+                metrics.increment("sse_slow_consumers_total")
+                return
+            self.queue.get_nowait()
+            metrics.increment("lines_dropped_total", reason="slow_consumer")
+            self.dropped += 1
+        self.queue.put_nowait(data)
+
+    async def get(self, timeout):
+        """Next message payload, or ``None`` if none arrived within ``timeout``."""
+        if self.overflowed:
+            raise SlowConsumer(self.channel)
+        if not self.queue.empty():
+            metrics.observe("sse_queue_depth", self.queue.qsize())
+            return self.queue.get_nowait()
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            if self.overflowed:
+                raise SlowConsumer(self.channel)
+            return None
+
+    async def close(self):
+        await self.hub.unsubscribe(self)
+
+
+class SubscriptionHub:
+    """One pattern subscription shared by all subscribers on an event loop."""
+
+    def __init__(self, client, queue_size=None, policy=None):
+        self.client = client
+        self.queue_size = queue_size or get_setting("HUB_QUEUE_SIZE")
+        self.policy = policy or get_setting("SLOW_CONSUMER")
+        self.subscriptions = {}
+        self._pubsub = None
+        self._reader = None
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.queue_size, self.policy)
+        async with self._lock:
+            if self._pubsub is None:
+                self._pubsub = self.client.pubsub()
+                await self._pubsub.psubscribe(CHANNEL_PATTERN)
+                self._reader = asyncio.ensure_future(self._run(self._pubsub))
+            self.subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        async with self._lock:
+            subscribers = self.subscriptions.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self.subscriptions.pop(subscription.channel, None)
+            if not self.subscriptions:
+                await self._stop()
+
+    async def _stop(self):
+        pubsub, reader = self._pubsub, self._reader
+        self._pubsub = self._reader = None
+        if reader is not None:
+            reader.cancel()
+            try:
+                await reader
+            except (asyncio.CancelledError, Exception):
+                pass
+        if pubsub is not None:
+            try:
+                await pubsub.punsubscribe(CHANNEL_PATTERN)
+                await pubsub.close()
+            except Exception as exc:
+                logger.error("Error closing shared pubsub: %s", exc)
+
+    def dispatch(self, channel, data):
+        for subscription in list(self.subscriptions.get(channel, ())):
+            subscription.deliver(data)
+
+    async def _run(self, pubsub):
+        try:
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message and message["type"] == "pmessage":
+                    self.dispatch(_decode(message["channel"]), message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            # Messages may have been missed, so every subscriber has to
+            # reconnect and resume from its last event id.
+            logger.error("Shared pubsub connection failed: %s", exc)
+            async with self._lock:
+                for subscribers in self.subscriptions.values():
+                    for subscription in subscribers:
+                        subscription.overflowed = True
+                self.subscriptions.clear()
+                if self._pubsub is pubsub:
+                    self._reader = None
+                    await self._stop()
+
+
+class DedicatedSubscription:
+    """A pub/sub connection of its own, used when the hub is disabled."""
+
+    def __init__(self, pubsub, channel):
+        self.pubsub = pubsub
+        self.channel = channel
+
+    @classmethod
+    async def open(cls, client, channel):
+        pubsub = client.pubsub()
+        await pubsub.subscribe(channel)
+        return cls(pubsub, channel)
+
+    async def get(self, timeout):
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        return message["data"] if message else None
+
+    async def close(self):
+        await self.pubsub.unsubscribe(self.channel)
+        await self.pubsub.close()
+
+
+# One hub per event loop: asyncio queues and Redis connections cannot be
+# shared between loops.
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub(client):
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None or hub.client is not client:
+        hub = _hubs[loop] = SubscriptionHub(client)
+    return hub
+
+
+async def open_subscription(client, channel):
+    """Subscribe to ``channel`` through the hub or a dedicated connection."""
+    if get_setting("SHARED_PUBSUB"):
+        return await get_hub(client).subscribe(channel)
+    return await DedicatedSubscription.open(client, channel)
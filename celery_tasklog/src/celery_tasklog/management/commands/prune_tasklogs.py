@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from celery_tasklog.conf import get_setting
+from celery_tasklog.pruning import prune_expired, trim_tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete task log lines older than CELERY_TASKLOG_RETENTION_DAYS and trim "
+        "tasks to their newest CELERY_TASKLOG_MAX_LINES lines."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retention-days", type=int, default=get_setting("RETENTION_DAYS"),
+            help="Delete lines older than this many days (0 disables).",
+        )
+        parser.add_argument(
+            "--max-lines", type=int, default=get_setting("MAX_LINES"),
+            help="Lines to keep per task (0 disables).",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=get_setting("PRUNE_BATCH_SIZE"),
+            help="Rows deleted per statement.",
+        )
+        parser.add_argument(
+            "--pause", type=float, default=0,
+            help="Seconds to sleep between batches to reduce database load.",
+        )
+
+    def handle(self, *args, **options):
+        expired = prune_expired(options["retention_days"], options["batch_size"], options["pause"])
+        self.stdout.write(f"Expired logs: {expired}")
+        trimmed = trim_tasks(options["max_lines"], options["batch_size"], pause=options["pause"])
+        self.stdout.write(f"Per-task line cap: {trimmed}")
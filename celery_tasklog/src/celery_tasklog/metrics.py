@@ -0,0 +1,216 @@
+"""Counters, gauges and histograms of the log pipeline.
+
+The capture, storage, publishing and SSE code report what they do through
+the module-level functions below; ``CELERY_TASKLOG_METRICS`` selects where
+it goes:
+
+- ``None`` (the default) disables metrics. Every call then returns after a
+  single global lookup, and ``start_timer()`` returns ``None`` so callers
+  do not even read the clock.
+- ``"registry"`` keeps them in an in-process ``Registry``, e.g. for tests.
+- ``"prometheus"`` does the same and serves them in the Prometheus text
+  format from the ``metrics/`` URL. Only the metrics of the serving process
+  are exposed, so use statsd to collect those of Celery workers.
+- ``"statsd"`` sends them over UDP to ``CELERY_TASKLOG_STATSD_ADDRESS``.
+- A dotted path to a class with the methods of ``Registry`` plugs in any
+  other backend.
+
+Metric names are prefixed with ``CELERY_TASKLOG_METRICS_PREFIX``.
+"""
+import socket
+import threading
+import time
+
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from .conf import get_setting
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+HELP = {
+    "lines_written_total": "Log lines stored.",
+    "lines_truncated_total": "Captured lines cut to CELERY_TASKLOG_MAX_LINE_LENGTH.",
+    "lines_dropped_total": "Log lines discarded, by reason.",
+    "flush_lines": "Lines per flushed batch.",
+    "flush_seconds": "Time to store a flushed batch.",
+    "publish_seconds": "Time to publish a flushed batch to Redis.",
+    "sse_connections": "Open SSE connections.",
+    "sse_queue_depth": "Messages waiting in an SSE client's queue when it reads.",
+    "sse_slow_consumers_total": "SSE clients disconnected because their queue overflowed.",
+    "backfill_seconds": "Time to replay stored lines to an SSE client.",
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+class Registry:
+    """Metrics kept in memory, readable with ``value()`` and ``render()``."""
+
+    def __init__(self, prefix=None):
+        self.prefix = get_setting("METRICS_PREFIX") if prefix is None else prefix
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value, labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add(self, name, value, labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, value, labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                buckets = SECONDS_BUCKETS if name.endswith("_seconds") else SIZE_BUCKETS
+                histogram = self.histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "count": 0, "sum": 0}
+            histogram["count"] += 1
+            histogram["sum"] += value
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+                    break
+
+    def value(self, name, **labels):
+        """A counter or gauge, or ``(count, sum)`` of a histogram."""
+        key = _key(name, labels)
+        if key in self.histograms:
+            histogram = self.histograms[key]
+            return histogram["count"], histogram["sum"]
+        return self.counters.get(key, self.gauges.get(key, 0))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        def series(name, labels, extra=()):
+            pairs = ",".join(f'{k}="{v}"' for k, v in labels + extra)
+            return f"{self.prefix}_{name}{{{pairs}}}" if pairs else f"{self.prefix}_{name}"
+
+        output = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                output.append(f"# HELP {self.prefix}_{name} {HELP.get(name, name)}")
+                output.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                describe(name, "counter")
+                output.append(f"{series(name, labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                describe(name, "gauge")
+                output.append(f"{series(name, labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                describe(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                    cumulative += count
+                    output.append(f"{series(name + '_bucket', labels, (('le', bound),))} {cumulative}")
+                output.append(f"{series(name + '_bucket', labels, (('le', '+Inf'),))} {histogram['count']}")
+                output.append(f"{series(name + '_sum', labels)} {histogram['sum']}")
+                output.append(f"{series(name + '_count', labels)} {histogram['count']}")
+        return "\n".join(output) + "\n"
+
+
+class StatsdSink:
+    """Send metrics as statsd UDP packets, labels appended to the name.
+
+    Histograms of ``_seconds`` are sent as timings in milliseconds. Send
+    errors are ignored, like lost packets.
+    """
+
+    def __init__(self, address=None, prefix=None):
+        host, _, port = (address or get_setting("STATSD_ADDRESS")).rpartition(":")
+        self.address = (host or "localhost", int(port))
+        self.prefix = get_setting("METRICS_PREFIX") if prefix is None else prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send(self, name, labels, value, kind):
+        if labels:
+            name = ".".join([name, *(str(labels[key]) for key in sorted(labels))])
+        try:
+            self.socket.sendto(f"{self.prefix}.{name}:{value}|{kind}".encode(), self.address)
+        except OSError:
+            pass
+
+    def increment(self, name, value, labels):
+        self._send(name, labels, value, "c")
+
+    def add(self, name, value, labels):
+        self._send(name, labels, f"{value:+}", "g")
+
+    def observe(self, name, value, labels):
+        if name.endswith("_seconds"):
+            self._send(name, labels, round(value * 1000, 3), "ms")
+        else:
+            self._send(name, labels, value, "h")
+
+
+SINKS = {"registry": Registry, "prometheus": Registry, "statsd": StatsdSink}
+
+_UNSET = object()
+_sink = _UNSET
+
+
+def get_sink():
+    """The sink selected by ``CELERY_TASKLOG_METRICS``, or ``None``."""
+    global _sink
+    if _sink is _UNSET:
+        name = get_setting("METRICS")
+        if not name:
+            _sink = None
+        else:
+            _sink = (SINKS.get(name) or import_string(name))()
+    return _sink
+
+
+@receiver(setting_changed)
+def reset(setting=None, **kwargs):
+    """Select the sink again, e.g. after ``override_settings`` in tests."""
+    global _sink
+    if setting is None or setting.startswith(("CELERY_TASKLOG_METRICS", "CELERY_TASKLOG_STATSD")):
+        _sink = _UNSET
+
+
+def increment(name, value=1, **labels):
+    sink = _sink if _sink is not _UNSET else get_sink()
+    if sink is not None:
+        sink.increment(name, value, labels)
+
+
+def add(name, value, **labels):
+    """Change a gauge by ``value``."""
+    sink = _sink if _sink is not _UNSET else get_sink()
+    if sink is not None:
+        sink.add(name, value, labels)
+
+
+def observe(name, value, **labels):
+    """Record ``value`` in a histogram."""
+    sink = _sink if _sink is not _UNSET else get_sink()
+    if sink is not None:
+        sink.observe(name, value, labels)
+
+
+def start_timer():
+    """A start time for ``observe_since``, or ``None`` when disabled."""
+    sink = _sink if _sink is not _UNSET else get_sink()
+    return None if sink is None else time.perf_counter()
+
+
+def observe_since(name, started, **labels):
+    """Record the seconds since ``start_timer()`` returned ``started``."""
+    if started is not None:
+        observe(name, time.perf_counter() - started, **labels)
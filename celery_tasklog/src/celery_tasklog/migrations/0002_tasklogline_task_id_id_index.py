@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_tasklog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tasklogline',
+            index=models.Index(fields=['task_id', 'id'], name='tasklog_task_id_id_idx'),
+        ),
+        # The composite index covers lookups on task_id alone.
+        migrations.AlterField(
+            model_name='tasklogline',
+            name='task_id',
+            field=models.CharField(max_length=255),
+        ),
+    ]
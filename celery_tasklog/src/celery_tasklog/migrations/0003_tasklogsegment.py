@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_tasklog', '0002_tasklogline_task_id_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskLogSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(max_length=255)),
+                ('first_line', models.BigIntegerField()),
+                ('last_line', models.BigIntegerField()),
+                ('line_count', models.PositiveIntegerField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('codec', models.CharField(max_length=10)),
+                ('size', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+            ],
+            options={
+                'ordering': ['task_id', 'first_line'],
+                'indexes': [models.Index(fields=['task_id', 'last_line'], name='tasklog_segment_last_line_idx')],
+                'constraints': [models.UniqueConstraint(fields=('task_id', 'first_line'), name='tasklog_segment_unique_first_line')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+
+from celery_tasklog.storage import decode_segment
+from celery_tasklog.summaries import _collect
+
+
+def backfill_summaries(apps, schema_editor):
+    TaskLogLine = apps.get_model('celery_tasklog', 'TaskLogLine')
+    TaskLogSegment = apps.get_model('celery_tasklog', 'TaskLogSegment')
+    TaskLogSummary = apps.get_model('celery_tasklog', 'TaskLogSummary')
+
+    task_ids = set(TaskLogLine.objects.order_by().values_list('task_id', flat=True).distinct())
+    task_ids.update(TaskLogSegment.objects.order_by().values_list('task_id', flat=True).distinct())
+    for task_id in task_ids:
+        def stored_lines():
+            yield from TaskLogLine.objects.filter(task_id=task_id).order_by('id').iterator()
+            for segment in TaskLogSegment.objects.filter(task_id=task_id).order_by('first_line').iterator():
+                yield from decode_segment(segment)
+
+        task = _collect(stored_lines()).get(task_id)
+        if task is not None:
+            TaskLogSummary.objects.create(task_id=task_id, **task)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_tasklog', '0003_tasklogsegment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskLogSummary',
+            fields=[
+                ('task_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('line_count', models.PositiveBigIntegerField(default=0)),
+                ('stdout_count', models.PositiveBigIntegerField(default=0)),
+                ('stderr_count', models.PositiveBigIntegerField(default=0)),
+                ('bytes', models.PositiveBigIntegerField(default=0)),
+                ('first_line_id', models.BigIntegerField(null=True)),
+                ('last_line_id', models.BigIntegerField(null=True)),
+                ('first_timestamp', models.DateTimeField(null=True)),
+                ('last_timestamp', models.DateTimeField(db_index=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'task log summaries',
+            },
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+from importlib import import_module
+
+from django.db import migrations, models
+
+search_index = import_module('celery_tasklog.migrations.0005_search_index')
+
+
+def restore_search_triggers(apps, schema_editor):
+    # SQLite adds the ``logger`` column by rebuilding the table, which drops
+    # the triggers keeping the FTS table of 0005 in sync.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        tables = schema_editor.connection.introspection.table_names(cursor)
+    if search_index.FTS_TABLE not in tables:
+        return
+    for statement in search_index.SQLITE_FORWARD:
+        if statement.startswith('CREATE TRIGGER'):
+            schema_editor.execute(statement.replace('CREATE TRIGGER', 'CREATE TRIGGER IF NOT EXISTS', 1))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_tasklog', '0005_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tasklogline',
+            name='extra',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tasklogline',
+            name='level',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tasklogline',
+            name='logger',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='tasklogline',
+            name='stream',
+            field=models.CharField(choices=[('stdout', 'stdout'), ('stderr', 'stderr'), ('log', 'log')], max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='tasklogline',
+            index=models.Index(fields=['level', 'id'], name='tasklog_level_id_idx'),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+    ]
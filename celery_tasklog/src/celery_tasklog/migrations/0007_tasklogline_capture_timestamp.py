@@ -0,0 +1,24 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_tasklog', '0006_tasklogline_structured'),
+    ]
+
+    # Lines carry the time they were captured instead of the time they were
+    # inserted. The column is unchanged, so only the state is altered; SQLite
+    # would otherwise rebuild the table.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='tasklogline',
+                    name='timestamp',
+                    field=models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+        ),
+    ]
@@ -1,14 +1,84 @@
 from django.db import models
+from django.utils import timezone
 
 
 class TaskLogLine(models.Model):
-    task_id = models.CharField(max_length=255, db_index=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
-    stream = models.CharField(max_length=10, choices=[("stdout", "stdout"), ("stderr", "stderr")])
+    task_id = models.CharField(max_length=255)
+    timestamp = models.DateTimeField(default=timezone.now)
+    stream = models.CharField(
+        max_length=10, choices=[("stdout", "stdout"), ("stderr", "stderr"), ("log", "log")]
+    )
     message = models.TextField()
+    # Set for records captured from the ``logging`` module (stream "log").
+    level = models.PositiveSmallIntegerField(null=True, blank=True)
+    logger = models.CharField(max_length=255, blank=True, default="")
+    extra = models.JSONField(null=True, blank=True)
 
     class Meta:
         ordering = ["id"]
+        indexes = [
+            # Serves every per-task read: filtering on task_id and walking
+            # the lines in id order for keyset pagination.
+            models.Index(fields=["task_id", "id"], name="tasklog_task_id_id_idx"),
+            # "Errors only" queries, newest first.
+            models.Index(fields=["level", "id"], name="tasklog_level_id_idx"),
+        ]
 
     def __str__(self):
         return f"{self.timestamp} [{self.stream}] {self.message}"
+
+
+class TaskLogSegment(models.Model):
+    """A run of consecutive log lines of one task, stored compressed.
+
+    Used instead of one ``TaskLogLine`` row per line when
+    ``CELERY_TASKLOG_STORAGE = "segments"``. Lines are numbered per task
+    starting at 1 and those numbers serve as their ids.
+    """
+    task_id = models.CharField(max_length=255)
+    first_line = models.BigIntegerField()
+    last_line = models.BigIntegerField()
+    line_count = models.PositiveIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    codec = models.CharField(max_length=10)
+    # Uncompressed size of the encoded lines, used to decide when a segment
+    # is full.
+    size = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        ordering = ["task_id", "first_line"]
+        constraints = [
+            models.UniqueConstraint(fields=["task_id", "first_line"], name="tasklog_segment_unique_first_line"),
+        ]
+        indexes = [
+            models.Index(fields=["task_id", "last_line"], name="tasklog_segment_last_line_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.task_id} lines {self.first_line}-{self.last_line}"
+
+
+class TaskLogSummary(models.Model):
+    """Running totals of a task's log, maintained by the writer on each flush.
+
+    Lets the task list and detail views show log metrics without counting
+    log rows, and lists the tasks that have logs when
+    ``django-celery-results`` is not available.
+    """
+    task_id = models.CharField(max_length=255, primary_key=True)
+    line_count = models.PositiveBigIntegerField(default=0)
+    stdout_count = models.PositiveBigIntegerField(default=0)
+    stderr_count = models.PositiveBigIntegerField(default=0)
+    bytes = models.PositiveBigIntegerField(default=0)
+    first_line_id = models.BigIntegerField(null=True)
+    last_line_id = models.BigIntegerField(null=True)
+    first_timestamp = models.DateTimeField(null=True)
+    last_timestamp = models.DateTimeField(null=True, db_index=True)
+
+    class Meta:
+        verbose_name_plural = "task log summaries"
+
+    def __str__(self):
+        return f"{self.task_id}: {self.line_count} lines"
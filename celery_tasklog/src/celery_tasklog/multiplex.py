@@ -0,0 +1,197 @@
+"""Log streams of several tasks over one SSE connection.
+
+``TaskMultiplexer`` runs the event source of every watched task (see
+``sse.py``) in an asyncio task of its own and merges their messages into one
+queue; every ``new_log`` message names its task. Tasks can be added and
+removed while the connection is open: the control API publishes the change
+on the connection's control channel, so it reaches the right ASGI process.
+"""
+import asyncio
+import json
+import logging
+
+from django_celery_results.models import TaskResult
+
+from .conf import get_setting
+from .hub import SlowConsumer, open_subscription
+from .publishing import control_channel
+from .sse import database_read, log_events
+
+logger = logging.getLogger(__name__)
+
+RUNNING_STATES = ("STARTED", "PROGRESS", "RETRY")
+
+
+def parse_task_ids(value):
+    """Parse ``a,b:120`` into ``{"a": 0, "b": 120}``.
+
+    A ``:<line id>`` suffix is the cursor to resume that task after.
+    """
+    tasks = {}
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        task_id, sep, after = item.rpartition(":")
+        if sep and after.isdigit():
+            tasks[task_id] = int(after)
+        else:
+            tasks[item] = 0
+    return tasks
+
+
+def running_task_ids(limit):
+    """Ids of the most recently created tasks in a running state."""
+    running = TaskResult.objects.filter(status__in=RUNNING_STATES).order_by("-date_created")
+    return list(running.values_list("task_id", flat=True)[:limit])
+
+
+class TaskMultiplexer:
+    """Merged log events of a changing set of tasks.
+
+    With ``follow_running`` the running tasks are looked up every
+    ``timeout`` seconds; new ones are added and the ones it added are
+    removed once they stopped running.
+    """
+
+    def __init__(self, client, session, tail=None, log_filter=None, follow_running=False,
+                 max_tasks=None, timeout=5):
+        self.client = client
+        self.session = session
+        self.tail = tail
+        self.log_filter = log_filter
+        self.follow_running = follow_running
+        self.max_tasks = max_tasks or get_setting("SSE_MAX_TASKS")
+        self.timeout = timeout
+        self.queue = asyncio.Queue(maxsize=get_setting("HUB_QUEUE_SIZE"))
+        self.sources = {}
+        self.running = set()
+        self._control_task = None
+
+    @property
+    def task_ids(self):
+        return sorted(self.sources)
+
+    def add(self, task_id, after=0):
+        """Start following ``task_id``; ``False`` if watched or over the limit."""
+        if task_id in self.sources or len(self.sources) >= self.max_tasks:
+            return False
+        events = log_events(
+            self.client, task_id, after=after, tail=self.tail, timeout=self.timeout, log_filter=self.log_filter
+        )
+        self.sources[task_id] = asyncio.get_running_loop().create_task(self._pump(task_id, events))
+        return True
+
+    async def remove(self, task_id):
+        """Stop following ``task_id``; ``False`` if it was not watched."""
+        source = self.sources.pop(task_id, None)
+        self.running.discard(task_id)
+        if source is None:
+            return False
+        source.cancel()
+        try:
+            await source
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    async def _pump(self, task_id, events):
+        try:
+            async for message in events:
+                if message is not None:
+                    await self.queue.put(message)
+        except Exception:
+            logger.exception(f"Log stream of task {task_id} failed")
+        finally:
+            await events.aclose()
+
+    async def _refresh_running(self):
+        running = set(await database_read(running_task_ids)(self.max_tasks))
+        added = [task_id for task_id in sorted(running - self.running) if self.add(task_id)]
+        self.running.update(added)
+        removed = [task_id for task_id in sorted(self.running - running) if await self.remove(task_id)]
+        return added, removed
+
+    async def _apply(self, payload):
+        try:
+            change = json.loads(payload)
+        except ValueError as exc:
+            logger.error("Invalid stream control message: %s", exc)
+            return [], []
+        added = [task_id for task_id in change.get("add", []) if self.add(task_id)]
+        # Tasks added explicitly are kept when they stop running.
+        self.running.difference_update(change.get("add", []))
+        removed = [task_id for task_id in change.get("remove", []) if await self.remove(task_id)]
+        return added, removed
+
+    async def _control(self, subscribed):
+        try:
+            subscription = await open_subscription(self.client, control_channel(self.session))
+        except Exception as exc:
+            subscribed.set_exception(exc)
+            return
+        subscribed.set_result(None)
+        loop = asyncio.get_running_loop()
+        next_refresh = loop.time() + self.timeout
+        try:
+            while True:
+                timeout = max(next_refresh - loop.time(), 0) if self.follow_running else self.timeout
+                try:
+                    payload = await subscription.get(timeout)
+                except SlowConsumer:
+                    logger.warning(f"Stream control channel of session {self.session} overflowed")
+                    return
+                added, removed = await self._apply(payload) if payload is not None else ([], [])
+                if self.follow_running and loop.time() >= next_refresh:
+                    next_refresh = loop.time() + self.timeout
+                    refreshed = await self._refresh_running()
+                    added, removed = added + refreshed[0], removed + refreshed[1]
+                if added or removed:
+                    await self.queue.put({
+                        "type": "subscriptions",
+                        "added": added,
+                        "removed": removed,
+                        "task_ids": self.task_ids,
+                    })
+        finally:
+            await subscription.close()
+
+    async def start(self, tasks=None):
+        """Follow the initial tasks and start listening for changes.
+
+        ``tasks`` maps task ids to their cursors.
+        """
+        for task_id, after in (tasks or {}).items():
+            self.add(task_id, after)
+        if self.follow_running:
+            await self._refresh_running()
+        # Subscribe before returning so no change published afterwards is
+        # missed.
+        subscribed = asyncio.get_running_loop().create_future()
+        self._control_task = asyncio.get_running_loop().create_task(self._control(subscribed))
+        await subscribed
+
+    async def events(self):
+        """Yield the messages of all watched tasks, ``None`` when idle."""
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(self.queue.get(), self.timeout)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield message
+        finally:
+            await self.close()
+
+    async def close(self):
+        """Stop following all tasks and the control channel."""
+        control, self._control_task = self._control_task, None
+        if control is not None:
+            control.cancel()
+            try:
+                await control
+            except asyncio.CancelledError:
+                pass
+        for task_id in list(self.sources):
+            await self.remove(task_id)
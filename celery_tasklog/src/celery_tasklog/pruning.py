@@ -0,0 +1,109 @@
+"""Deletion of old log data.
+
+``CELERY_TASKLOG_RETENTION_DAYS`` removes lines older than the given number
+of days and ``CELERY_TASKLOG_MAX_LINES`` keeps only the most recent lines of
+each task, like a ring buffer. Both delete in batches of
+``CELERY_TASKLOG_PRUNE_BATCH_SIZE`` rows bounded by primary key ranges, so
+every statement is a short range delete instead of one huge transaction
+holding locks on the whole table.
+"""
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .conf import get_setting
+from .models import TaskLogLine, TaskLogSegment, TaskLogSummary
+from .summaries import refresh_summaries
+
+
+class PruneResult:
+    def __init__(self):
+        self.deleted = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.deleted / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f"deleted {self.deleted} rows in {self.batches} batches "
+            f"in {self.seconds:.2f}s ({self.rows_per_sec:.0f} rows/sec)"
+        )
+
+
+def _delete_in_batches(queryset, batch_size, result, pause=0):
+    """Delete the rows of ``queryset`` in primary-key ordered batches."""
+    while True:
+        ids = list(queryset.order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return
+        deleted, _ = queryset.filter(pk__gte=ids[0], pk__lte=ids[-1]).delete()
+        result.deleted += deleted
+        result.batches += 1
+        if len(ids) < batch_size:
+            return
+        if pause:
+            time.sleep(pause)
+
+
+def prune_expired(retention_days=None, batch_size=None, pause=0):
+    """Delete log lines and segments older than ``retention_days``."""
+    if retention_days is None:
+        retention_days = get_setting("RETENTION_DAYS")
+    batch_size = batch_size or get_setting("PRUNE_BATCH_SIZE")
+    result = PruneResult()
+    if not retention_days:
+        return result
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    start = time.monotonic()
+    _delete_in_batches(TaskLogLine.objects.filter(timestamp__lt=cutoff), batch_size, result, pause)
+    _delete_in_batches(TaskLogSegment.objects.filter(last_timestamp__lt=cutoff), batch_size, result, pause)
+    # Tasks that logged both before and after the cutoff lost some lines.
+    partly_expired = TaskLogSummary.objects.filter(
+        first_timestamp__lt=cutoff, last_timestamp__gte=cutoff
+    ).values_list('task_id', flat=True)
+    refresh_summaries(list(partly_expired))
+    TaskLogSummary.objects.filter(last_timestamp__lt=cutoff).delete()
+    result.seconds = time.monotonic() - start
+    return result
+
+
+def trim_tasks(max_lines=None, batch_size=None, task_ids=None, pause=0):
+    """Keep only the newest ``max_lines`` lines of every task.
+
+    Segments are trimmed whole, so a task may keep up to one segment more
+    than ``max_lines``.
+    """
+    if max_lines is None:
+        max_lines = get_setting("MAX_LINES")
+    batch_size = batch_size or get_setting("PRUNE_BATCH_SIZE")
+    result = PruneResult()
+    if not max_lines:
+        return result
+    start = time.monotonic()
+
+    # Summaries count the lines of every task, so only tasks over the cap
+    # are looked at.
+    oversized = TaskLogSummary.objects.filter(line_count__gt=max_lines)
+    if task_ids is not None:
+        oversized = oversized.filter(task_id__in=task_ids)
+    trimmed = set()
+    for task_id in oversized.values_list("task_id", flat=True).iterator():
+        task_lines = TaskLogLine.objects.filter(task_id=task_id)
+        oldest_kept = task_lines.order_by("-id").values_list("id", flat=True)[max_lines - 1:max_lines].first()
+        if oldest_kept is not None:
+            _delete_in_batches(task_lines.filter(id__lt=oldest_kept), batch_size, result, pause)
+
+        segments = TaskLogSegment.objects.filter(task_id=task_id)
+        last_line = segments.order_by("-first_line").values_list("last_line", flat=True).first()
+        if last_line is not None and last_line > max_lines:
+            obsolete = segments.filter(last_line__lte=last_line - max_lines)
+            _delete_in_batches(obsolete, batch_size, result, pause)
+        trimmed.add(task_id)
+
+    refresh_summaries(trimmed)
+    result.seconds = time.monotonic() - start
+    return result
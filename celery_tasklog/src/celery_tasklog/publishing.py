@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.utils import timezone
+import json
+import logging
+import redis
+
+from . import metrics
+from .conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+# Redis client used by workers to broadcast log lines
+redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+
+
+def channel_name(task_id):
+    return f"tasklog:{task_id}"
+
+
+def control_channel(session):
+    """Channel carrying subscription changes for a multi-task SSE stream."""
+    return f"tasklog:control:{session}"
+
+
+def stream_key(task_id):
+    return f"tasklog:stream:{task_id}"
+
+
+def stream_entry_id(line_id):
+    """Redis stream entry id for a log line; streams are ordered by row id."""
+    return f"{line_id}-0"
+
+
+def log_message(line):
+    """Build the ``new_log`` event consumed by the SSE stream."""
+    message = {
+        'type': 'new_log',
+        'id': line.id,
+        'timestamp': line.timestamp.isoformat() if line.timestamp else None,
+        'stream': line.stream,
+        'message': line.message,
+        'task_id': line.task_id,
+    }
+    if line.level is not None:
+        message.update(level=line.level, logger=line.logger, extra=line.extra)
+    return message
+
+
+def status_message(task_id, status, meta=None, error=None):
+    """Build the ``status`` event sent when a task changes state."""
+    message = {
+        'type': 'status',
+        'task_id': task_id,
+        'status': status,
+        'progress': meta.get('progress') if isinstance(meta, dict) else None,
+        'timestamp': timezone.now().isoformat(),
+    }
+    if meta is not None:
+        message['meta'] = meta
+    if error is not None:
+        message['error'] = error
+    return message
+
+
+def _next_status_entry_id(top_entry_id):
+    """Entry id ordered after the newest entry, before the next line.
+
+    Lines use ``<line id>-0``; status entries take the following sequence
+    numbers of the newest line id, so readers still see the line id the
+    status followed.
+    """
+    if top_entry_id is None:
+        return "0-1"
+    if isinstance(top_entry_id, bytes):
+        top_entry_id = top_entry_id.decode()
+    line_id, seq = top_entry_id.split("-", 1)
+    return f"{line_id}-{int(seq) + 1}"
+
+
+def _add_status_entry(key, data):
+    def add(pipe):
+        top = pipe.xrevrange(key, count=1)
+        entry_id = _next_status_entry_id(top[0][0] if top else None)
+        pipe.multi()
+        pipe.xadd(key, {'data': data}, id=entry_id, maxlen=get_setting("STREAM_MAXLEN"), approximate=True)
+        pipe.expire(key, get_setting("STREAM_TTL"))
+
+    # Retried if a line is appended between reading the newest entry and
+    # adding the status after it.
+    redis_client.transaction(add, key)
+
+
+def publish_status(task_id, status, meta=None, error=None):
+    """Publish a task state change on the channel (or stream) of its logs."""
+    if not get_setting("PUBLISH") or not get_setting("STATUS_EVENTS"):
+        return
+    data = json.dumps(status_message(task_id, status, meta, error), default=str)
+    try:
+        if get_setting("TRANSPORT") == "stream":
+            _add_status_entry(stream_key(task_id), data)
+        else:
+            redis_client.publish(channel_name(task_id), data)
+    except Exception as e:
+        logger.error(f"Redis publish failed for status {status} of task {task_id}: {e}")
+
+
+def _queue_pubsub(pipe, lines):
+    for line in lines:
+        pipe.publish(channel_name(line.task_id), json.dumps(log_message(line)))
+
+
+def _queue_stream(pipe, lines):
+    maxlen = get_setting("STREAM_MAXLEN")
+    keys = set()
+    for line in lines:
+        if line.id is None:
+            # Stream entries are keyed by row id so readers can resume from
+            # a database cursor; without one there is nothing to key on.
+            logger.debug(f"Not adding log line without id to stream for task {line.task_id}")
+            continue
+        key = stream_key(line.task_id)
+        keys.add(key)
+        pipe.xadd(
+            key,
+            {'data': json.dumps(log_message(line))},
+            id=stream_entry_id(line.id),
+            maxlen=maxlen,
+            approximate=True,
+        )
+    for key in keys:
+        pipe.expire(key, get_setting("STREAM_TTL"))
+
+
+def publish_log_lines(lines):
+    """Publish saved log lines for live consumers in one round trip.
+
+    Every line is still sent as its own ``new_log`` message so existing
+    consumers keep working, but the commands are queued on a non
+    transactional pipeline and sent to Redis together. With the ``stream``
+    transport the lines are appended to a capped per-task Redis stream
+    instead of being published on the task channel.
+    """
+    if not lines or not get_setting("PUBLISH"):
+        return
+    started = metrics.start_timer()
+    transport = get_setting("TRANSPORT")
+    pipe = redis_client.pipeline(transaction=False)
+    if transport == "stream":
+        _queue_stream(pipe, lines)
+    else:
+        _queue_pubsub(pipe, lines)
+    try:
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Redis publish failed for {len(lines)} log lines: {e}")
+    metrics.observe_since("publish_seconds", started, transport=transport)
@@ -0,0 +1,92 @@
+"""Indexed substring search over stored log lines.
+
+A search backend narrows a ``TaskLogLine`` queryset to the lines whose
+message contains a string, case-insensitively. Migration ``0005`` creates
+the index the backend relies on:
+
+- PostgreSQL: a ``pg_trgm`` GIN index on ``UPPER(message)``, the expression
+  ``icontains`` compiles to, so ``ScanSearch`` is an index lookup there.
+- SQLite: an external-content FTS5 table with the ``trigram`` tokenizer,
+  kept in sync with ``celery_tasklog_tasklogline`` by triggers.
+
+Other databases fall back to an unindexed ``icontains`` scan. Only the
+``lines`` storage is searchable; lines packed into segments are compressed
+and not indexed. Select the backend with ``CELERY_TASKLOG_SEARCH_BACKEND``.
+"""
+from functools import lru_cache
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .conf import get_setting
+from .models import TaskLogLine
+
+FTS_TABLE = "celery_tasklog_tasklogline_fts"
+
+
+class ScanSearch:
+    """``icontains`` match, indexed by the trigram index on PostgreSQL."""
+
+    def filter(self, queryset, query):
+        return queryset.filter(message__icontains=query)
+
+
+class FTS5Search(ScanSearch):
+    """Phrase match against the SQLite FTS5 trigram table."""
+
+    def filter(self, queryset, query):
+        # Trigrams need at least three characters.
+        if len(query) < 3:
+            return super().filter(queryset, query)
+        phrase = '"{}"'.format(query.replace('"', '""'))
+        matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [phrase])
+        return queryset.filter(id__in=matches)
+
+
+@lru_cache(maxsize=None)
+def _has_fts_table():
+    with connection.cursor() as cursor:
+        return FTS_TABLE in connection.introspection.table_names(cursor)
+
+
+def get_search_backend():
+    """Return the search backend for ``CELERY_TASKLOG_SEARCH_BACKEND``.
+
+    ``"auto"`` uses the FTS5 table on SQLite when the migration could create
+    it and ``icontains`` everywhere else; ``"scan"`` always uses
+    ``icontains``.
+    """
+    name = get_setting("SEARCH_BACKEND")
+    if name == "auto":
+        name = "fts5" if connection.vendor == "sqlite" and _has_fts_table() else "scan"
+    if name == "fts5":
+        return FTS5Search()
+    if name == "scan":
+        return ScanSearch()
+    raise ValueError(f"Unknown CELERY_TASKLOG_SEARCH_BACKEND {name!r}")
+
+
+def search_lines(query, task_id=None, stream=None, since=None, before=None, limit=50):
+    """Lines containing ``query``, newest first.
+
+    ``before`` is the id of the last hit of the previous page.
+    """
+    queryset = TaskLogLine.objects.all()
+    if task_id:
+        queryset = queryset.filter(task_id=task_id)
+    if stream:
+        queryset = queryset.filter(stream=stream)
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=since)
+    if before is not None:
+        queryset = queryset.filter(id__lt=before)
+    queryset = get_search_backend().filter(queryset, query)
+    return list(queryset.order_by("-id")[:limit])
+
+
+def context_lines(hit, count):
+    """The ``count`` lines of the hit's task before and after it."""
+    task_lines = TaskLogLine.objects.filter(task_id=hit.task_id)
+    before = list(task_lines.filter(id__lt=hit.id).order_by("-id")[:count])
+    after = list(task_lines.filter(id__gt=hit.id).order_by("id")[:count])
+    return list(reversed(before)), after
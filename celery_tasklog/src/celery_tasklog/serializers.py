@@ -7,7 +7,19 @@ from .models import TaskLogLine
 class TaskLogLineSerializer(serializers.ModelSerializer):
     class Meta:
         model = TaskLogLine
-        fields = ['id', 'timestamp', 'stream', 'message']
+        fields = ['id', 'timestamp', 'stream', 'message', 'level', 'logger', 'extra']
+
+
+class LogSearchHitSerializer(serializers.ModelSerializer):
+    context_before = TaskLogLineSerializer(many=True, read_only=True)
+    context_after = TaskLogLineSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = TaskLogLine
+        fields = [
+            'id', 'task_id', 'timestamp', 'stream', 'message', 'level', 'logger', 'extra',
+            'context_before', 'context_after',
+        ]
 
 
 class TaskListSerializer(serializers.Serializer):
@@ -17,6 +29,8 @@ class TaskListSerializer(serializers.Serializer):
     started_at = serializers.DateTimeField(allow_null=True)
     completed_at = serializers.DateTimeField(allow_null=True)
     progress = serializers.IntegerField(allow_null=True)
+    log_count = serializers.IntegerField()
+    last_log_at = serializers.DateTimeField(allow_null=True)
 
 
 class TaskDetailSerializer(serializers.Serializer):
@@ -29,3 +43,4 @@ class TaskDetailSerializer(serializers.Serializer):
     result = serializers.JSONField(allow_null=True)
     logs = TaskLogLineSerializer(many=True)
     log_count = serializers.IntegerField()
+    last_log_at = serializers.DateTimeField(allow_null=True)
@@ -1,23 +1,34 @@
+from celery.signals import task_failure, task_postrun, task_prerun, task_retry, worker_init, worker_process_init
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.conf import settings
+from .conf import get_setting
 from .models import TaskLogLine
-import json
+from .publishing import publish_log_lines, publish_status
+from .streams import install_streams
+from .summaries import update_summaries
 import logging
-import redis
 
 logger = logging.getLogger(__name__)
 
-# Redis client for broadcasting log lines
-redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
-
 # NOTE:
 # Celery workers run in separate processes from the Django application that
 # serves the SSE streams.  Using in-memory data structures to keep track of
 # connections here would therefore never work.  Connection management now
 # lives entirely in the Django view and this signal simply publishes new log
 # lines to Redis so any listening consumers can pick them up.
+#
+# Lines captured by ``DBLogWriter`` are saved with ``bulk_create``, counted
+# in the task summary and published by the writer itself (see
+# ``buffers.save_log_lines``), so this receiver only handles log lines saved
+# one at a time elsewhere, e.g. from the admin or from application code.
+
 
+@worker_init.connect
+@worker_process_init.connect
+def install_task_streams(**kwargs):
+    """Route the worker's stdout/stderr by task context from the start."""
+    if get_setting("CONTEXT_STREAMS"):
+        install_streams()
 
 
 @receiver(post_save, sender=TaskLogLine)
@@ -25,20 +36,32 @@ def broadcast_new_log(sender, instance, created, **kwargs):
     """Broadcast new log lines to SSE connections"""
     logger.debug(f"Signal received for log line: {instance.id} for task {instance.task_id}")
     if created:
-        message = {
-            'type': 'new_log',
-            'id': instance.id,
-            'timestamp': instance.timestamp.isoformat(),
-            'stream': instance.stream,
-            'message': instance.message,
-            'task_id': instance.task_id
-        }
-
+        update_summaries([instance])
         # Publish to Redis channel for real-time updates
-        try:
-            redis_client.publish(f"tasklog:{instance.task_id}", json.dumps(message))
-        except Exception as e:
-            logger.error(f"Redis publish failed for task {instance.task_id}: {e}")
+        publish_log_lines([instance])
+
+
+# Task state changes are published on the channel of the task's logs, so SSE
+# clients get them pushed instead of polling the task API. Progress updates
+# come from ``TerminalLoggingTask.update_state``.
+
+@task_prerun.connect
+def broadcast_task_started(sender=None, task_id=None, **kwargs):
+    publish_status(task_id, 'STARTED')
+
+
+@task_postrun.connect
+def broadcast_task_finished(sender=None, task_id=None, state=None, **kwargs):
+    # Failures and retries are published by their own signals, with details.
+    if state not in ('FAILURE', 'RETRY'):
+        publish_status(task_id, state)
+
+
+@task_failure.connect
+def broadcast_task_failed(sender=None, task_id=None, exception=None, **kwargs):
+    publish_status(task_id, 'FAILURE', error=f"{type(exception).__name__}: {exception}"[:500])
+
 
-        # Connection management happens in the Django web process. Workers only
-        # publish to Redis so any subscribed web consumers can relay the data.
+@task_retry.connect
+def broadcast_task_retry(sender=None, request=None, reason=None, **kwargs):
+    publish_status(request.id, 'RETRY', error=str(reason)[:500])
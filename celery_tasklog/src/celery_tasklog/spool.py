@@ -0,0 +1,299 @@
+"""Worker-local spool decoupling log capture from the database.
+
+With ``CELERY_TASKLOG_SPOOL_DIR`` set, ``capture_output`` appends captured
+lines to a file of the worker process instead of inserting them, so a slow
+or unavailable database never delays or fails a task. A shipper thread
+bulk-loads the spooled lines in batches of up to
+``CELERY_TASKLOG_SPOOL_BATCH_SIZE`` through ``save_log_lines`` (storage,
+summaries and Redis publishing) every ``CELERY_TASKLOG_FLUSH_INTERVAL``
+milliseconds or when a task flushes, so bursts become large inserts.
+
+Layout: each process writes to ``<spool dir>/<host>-<pid>/`` which holds
+numbered segment files of JSON lines, rolled over at
+``CELERY_TASKLOG_SPOOL_SEGMENT_BYTES``, a ``checkpoint`` with the segment
+and offset shipped so far and a ``lock`` file the process keeps locked.
+Shipped segments are deleted. When a process dies, the lock is released
+and the shipper of any other process on the host (or the
+``ship_tasklog_spool`` command) takes the directory over and ships the rest
+from the checkpoint. Lines are shipped at least once: a crash between an
+insert and the checkpoint update ships that batch again.
+
+``CELERY_TASKLOG_SPOOL_FSYNC`` sets how durable appends are: ``"always"``
+(fsync every line), ``"flush"`` (when the task flushes or ends and at
+segment roll-over) or ``"never"`` (leave it to the OS). POSIX only.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+
+from django.db import connection
+from django.utils.dateparse import parse_datetime
+
+from .buffers import save_log_lines
+from .conf import get_setting
+from .models import TaskLogLine
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".spool"
+FSYNC_POLICIES = ("always", "flush", "never")
+
+
+def encode_line(line):
+    record = {"t": line.task_id, "s": line.stream, "m": line.message, "ts": line.timestamp.isoformat()}
+    if line.level is not None:
+        record.update(l=line.level, g=line.logger, x=line.extra)
+    return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+
+def decode_line(data):
+    record = json.loads(data)
+    return TaskLogLine(
+        task_id=record["t"],
+        stream=record["s"],
+        message=record["m"],
+        timestamp=parse_datetime(record["ts"]),
+        level=record.get("l"),
+        logger=record.get("g") or "",
+        extra=record.get("x"),
+    )
+
+
+def segment_path(directory, number):
+    return os.path.join(directory, f"{number:010d}{SEGMENT_SUFFIX}")
+
+
+def segment_numbers(directory):
+    return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+
+def read_checkpoint(directory):
+    """``(segment, offset)`` up to which ``directory`` has been shipped."""
+    try:
+        with open(os.path.join(directory, "checkpoint")) as checkpoint:
+            segment, offset = checkpoint.read().split()
+        return int(segment), int(offset)
+    except (FileNotFoundError, ValueError):
+        return 0, 0
+
+
+def write_checkpoint(directory, segment, offset):
+    path = os.path.join(directory, "checkpoint")
+    with open(path + ".tmp", "w") as checkpoint:
+        checkpoint.write(f"{segment} {offset}")
+    os.replace(path + ".tmp", path)
+
+
+def ship_directory(directory, batch_size, active_segment=None):
+    """Ship the lines spooled in ``directory`` after its checkpoint.
+
+    Complete segments are deleted once shipped; ``active_segment`` is still
+    being written to, so only its complete lines are shipped. A partial
+    last line of any other segment was cut short by a crash and is skipped.
+    Returns the number of lines shipped.
+    """
+    shipped = 0
+    checkpoint_segment, checkpoint_offset = read_checkpoint(directory)
+    for number in segment_numbers(directory):
+        if number < checkpoint_segment:
+            os.remove(segment_path(directory, number))
+            continue
+        offset = checkpoint_offset if number == checkpoint_segment else 0
+        with open(segment_path(directory, number), "rb") as segment:
+            segment.seek(offset)
+            while True:
+                lines = []
+                complete = True
+                for data in iter(segment.readline, b""):
+                    if not data.endswith(b"\n"):
+                        complete = False
+                        break
+                    lines.append(decode_line(data))
+                    offset += len(data)
+                    if len(lines) >= batch_size:
+                        break
+                if lines:
+                    save_log_lines(lines)
+                    write_checkpoint(directory, number, offset)
+                    shipped += len(lines)
+                    segment.seek(offset)
+                if not complete and number != active_segment:
+                    logger.warning(f"Skipping a partial spooled line in {segment.name}")
+                if not complete or len(lines) < batch_size:
+                    break
+        if number == active_segment:
+            break
+        write_checkpoint(directory, number + 1, 0)
+        os.remove(segment_path(directory, number))
+    return shipped
+
+
+def try_lock(directory):
+    """The open, exclusively locked lock file of ``directory``, or ``None``."""
+    try:
+        lock = open(os.path.join(directory, "lock"), "a")
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+def ship_orphans(root, batch_size):
+    """Ship and remove the spool directories no living process holds."""
+    shipped = 0
+    for name in sorted(os.listdir(root)):
+        directory = os.path.join(root, name)
+        if not os.path.isdir(directory):
+            continue
+        lock = try_lock(directory)
+        if lock is None:
+            continue
+        try:
+            shipped += ship_directory(directory, batch_size)
+            shutil.rmtree(directory)
+        finally:
+            lock.close()
+    return shipped
+
+
+class Spool:
+    """The spool directory of this process and the thread shipping it."""
+
+    def __init__(self, root=None, fsync=None, segment_bytes=None, batch_size=None, interval=None):
+        fsync = fsync or get_setting("SPOOL_FSYNC")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown spool fsync policy {fsync!r}, expected one of {FSYNC_POLICIES}")
+        self.root = root or get_setting("SPOOL_DIR")
+        self.fsync = fsync
+        self.segment_bytes = segment_bytes or get_setting("SPOOL_SEGMENT_BYTES")
+        self.batch_size = batch_size or get_setting("SPOOL_BATCH_SIZE")
+        if interval is None:
+            interval = get_setting("FLUSH_INTERVAL")
+        self.interval = interval / 1000.0
+        self.pid = os.getpid()
+        self.directory = os.path.join(self.root, f"{socket.gethostname()}-{self.pid}")
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = try_lock(self.directory)
+        if self._lock_file is None:
+            raise RuntimeError(f"Spool directory {self.directory} is locked by another process")
+        numbers = segment_numbers(self.directory)
+        self.segment = numbers[-1] + 1 if numbers else 1
+        self._file = open(segment_path(self.directory, self.segment), "ab")
+        self._size = 0
+        self._lock = threading.Lock()
+        self._ship_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="celery-tasklog-shipper", daemon=True)
+        self._thread.start()
+
+    def append(self, line):
+        data = encode_line(line)
+        with self._lock:
+            self._file.write(data)
+            self._size += len(data)
+            if self.fsync == "always":
+                self._sync(durable=True)
+            if self._size >= self.segment_bytes:
+                self._roll()
+
+    def flush(self):
+        """Make appended lines visible to the shipper and wake it up."""
+        with self._lock:
+            self._sync(durable=self.fsync != "never")
+        self._wake.set()
+
+    def _sync(self, durable):
+        self._file.flush()
+        if durable:
+            os.fsync(self._file.fileno())
+
+    def _roll(self):
+        self._sync(durable=self.fsync != "never")
+        self._file.close()
+        self.segment += 1
+        self._file = open(segment_path(self.directory, self.segment), "ab")
+        self._size = 0
+
+    def ship(self):
+        """Ship what was spooled so far, then any orphaned directories."""
+        with self._ship_lock:
+            with self._lock:
+                self._sync(durable=False)
+                active = self.segment
+            shipped = ship_directory(self.directory, self.batch_size, active_segment=active)
+            return shipped + ship_orphans(self.root, self.batch_size)
+
+    def _run(self):
+        try:
+            while not self._closed:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                try:
+                    self.ship()
+                except Exception:
+                    # The lines stay spooled and are retried next time.
+                    logger.exception("Failed to ship spooled task log lines")
+                    connection.close()
+        finally:
+            connection.close()
+
+    def close(self):
+        """Stop the shipper, ship what is left and remove the directory."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        with self._lock:
+            self._sync(durable=self.fsync != "never")
+            self._file.close()
+        try:
+            with self._ship_lock:
+                ship_directory(self.directory, self.batch_size)
+            shutil.rmtree(self.directory)
+        except Exception:
+            # Left for the shipper of another process.
+            logger.exception("Failed to ship spooled task log lines at exit")
+        finally:
+            connection.close()
+            self._lock_file.close()
+
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def get_spool():
+    """The spool of this process, created on first use (also after a fork)."""
+    global _spool
+    with _spool_lock:
+        if _spool is None or _spool.pid != os.getpid():
+            _spool = Spool()
+            atexit.register(_spool.close)
+        return _spool
+
+
+class SpoolBuffer:
+    """Buffer interface of ``capture_output`` writing to the process spool."""
+
+    def __init__(self, spool=None):
+        self.spool = spool or get_spool()
+
+    def add(self, line: TaskLogLine):
+        self.spool.append(line)
+
+    def flush(self, wait=False):
+        self.spool.flush()
+
+    def close(self):
+        self.spool.flush()
@@ -0,0 +1,381 @@
+"""Sources of log events for the SSE views.
+
+Each source is an async generator that yields ``new_log`` dictionaries in id
+order, starting after the line id given as cursor, and ``None`` whenever no
+new line arrived within ``timeout`` seconds so the view can send a keepalive.
+Sources take an optional ``LogFilter`` that drops unwanted lines before they
+are sent, both from the stored lines and from the live feed. ``coalesce``
+groups the messages of a source into batches for the view.
+"""
+import asyncio
+import functools
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from . import metrics
+from .conf import get_setting
+from .hub import SlowConsumer, open_subscription
+from .storage import get_storage
+from .publishing import channel_name, log_message, stream_entry_id, stream_key
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cursor(value):
+    """Return the line id in a ``Last-Event-ID``/``after`` value, or ``0``."""
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class Message(dict):
+    """A message decoded from Redis that remembers its published JSON.
+
+    Formatting it reuses ``raw`` instead of encoding the dict again.
+    """
+    raw = None
+
+
+def _decode_message(payload):
+    raw = payload.decode() if isinstance(payload, bytes) else payload
+    message = Message(json.loads(raw))
+    message.raw = raw
+    return message
+
+
+def _encode(message):
+    return message.raw if getattr(message, "raw", None) is not None else json.dumps(message)
+
+
+def format_event(message, with_id=True):
+    """Format ``message`` as an SSE event, with its line id as event id."""
+    data = f"data: {_encode(message)}\n\n"
+    if with_id and message.get("id") is not None:
+        return f"id: {message['id']}\n{data}"
+    return data
+
+
+def format_batch(messages, with_id=True):
+    """Format ``messages`` as one ``logs`` event whose data is a JSON array.
+
+    The event id is the last line id in the batch, so ``Last-Event-ID``
+    resumes after the whole batch.
+    """
+    data = f"event: logs\ndata: [{','.join(_encode(m) for m in messages)}]\n\n"
+    last_id = next((m["id"] for m in reversed(messages) if m.get("id") is not None), None)
+    if with_id and last_id is not None:
+        return f"id: {last_id}\n{data}"
+    return data
+
+
+_executors = {}
+
+
+def _read_executor(size):
+    executor = _executors.get(size)
+    if executor is None:
+        executor = _executors[size] = ThreadPoolExecutor(max_workers=size, thread_name_prefix="tasklog-read")
+    return executor
+
+
+def database_read(func):
+    """Wrap the sync database read ``func`` for use from the SSE views.
+
+    Reads run on a pool of ``CELERY_TASKLOG_SSE_READ_THREADS`` threads, each
+    with its own database connection, so backfills of different clients run
+    concurrently instead of queueing on the single thread ``sync_to_async``
+    uses for thread-sensitive code. ``0`` falls back to that thread.
+    """
+    size = get_setting("SSE_READ_THREADS")
+    if not size:
+        return sync_to_async(func)
+
+    @functools.wraps(func)
+    def read(*args, **kwargs):
+        # Pool threads live outside the request cycle that normally
+        # recycles broken or expired connections.
+        close_old_connections()
+        return func(*args, **kwargs)
+
+    return sync_to_async(read, thread_sensitive=False, executor=_read_executor(size))
+
+
+def parse_level(value):
+    """A logging level given by number or name (``40``, ``error``).
+
+    Returns ``None`` for an empty value and raises ``ValueError`` for an
+    unknown name.
+    """
+    if value in (None, ""):
+        return None
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown logging level {value!r}")
+    return level
+
+
+class LogFilter:
+    """Server-side selection of the lines sent to one SSE client.
+
+    ``stream`` keeps only lines of that stream, ``min_level`` only
+    ``logging`` records of at least that level and ``grep`` only lines whose
+    message matches a regular expression, compiled once per connection
+    (``re.error`` is raised for an invalid one). Events other than log lines
+    always pass.
+    """
+
+    def __init__(self, stream=None, grep=None, min_level=None):
+        self.stream = stream or None
+        self.pattern = re.compile(grep) if grep else None
+        self.min_level = min_level
+
+    def __bool__(self):
+        return self.stream is not None or self.pattern is not None or self.min_level is not None
+
+    def matches(self, message):
+        if message.get("type") != "new_log":
+            return True
+        if self.stream is not None and message.get("stream") != self.stream:
+            return False
+        if self.min_level is not None and (message.get("level") or 0) < self.min_level:
+            return False
+        if self.pattern is not None and not self.pattern.search(message.get("message") or ""):
+            return False
+        return True
+
+
+def _split_entry_id(entry_id):
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    line_id, seq = entry_id.split("-", 1)
+    return int(line_id), int(seq)
+
+
+async def backfill(task_id, after=0, before=None, log_filter=None):
+    """Yield stored lines of ``task_id`` with ``after < id < before``.
+
+    Rows are read in keyset-paginated chunks of
+    ``CELERY_TASKLOG_BACKFILL_CHUNK_SIZE`` so the first lines are sent while
+    later ones are still being fetched and memory stays bounded. The stream
+    and level filters are applied by the query, the regular expression per
+    line.
+    """
+    started = metrics.start_timer()
+    chunk_size = get_setting("BACKFILL_CHUNK_SIZE")
+    storage = get_storage()
+    stream = log_filter.stream if log_filter else None
+    min_level = log_filter.min_level if log_filter else None
+    while True:
+        chunk = await database_read(storage.lines)(
+            task_id, after=after, before=before, limit=chunk_size, stream=stream, min_level=min_level
+        )
+        for log in chunk:
+            message = log_message(log)
+            if not log_filter or log_filter.matches(message):
+                yield message
+        if len(chunk) < chunk_size:
+            metrics.observe_since("backfill_seconds", started)
+            return
+        after = chunk[-1].id
+
+
+def _filtered_tail_cursor(task_id, after, tail, log_filter):
+    """Cursor before the last ``tail`` stored lines that pass ``log_filter``.
+
+    Reads backwards in chunks until enough matching lines were seen.
+    """
+    chunk_size = get_setting("BACKFILL_CHUNK_SIZE")
+    storage = get_storage()
+    before = None
+    while True:
+        chunk = storage.lines(
+            task_id, after=after, before=before, limit=chunk_size, reverse=True,
+            stream=log_filter.stream, min_level=log_filter.min_level,
+        )
+        for log in chunk:
+            if log_filter.matches(log_message(log)):
+                tail -= 1
+                if tail == 0:
+                    return log.id - 1
+        if len(chunk) < chunk_size:
+            return after
+        before = chunk[-1].id
+
+
+async def start_cursor(task_id, after=0, tail=None, log_filter=None):
+    """Cursor to start streaming from; ``tail`` limits it to the last N lines.
+
+    With a filter, ``tail`` counts the matching lines only.
+    """
+    if not tail:
+        return after
+    if log_filter:
+        return await database_read(_filtered_tail_cursor)(task_id, after, tail, log_filter)
+    return await database_read(get_storage().tail_cursor)(task_id, after, tail)
+
+
+async def pubsub_events(client, task_id, after=0, tail=None, timeout=5, log_filter=None):
+    """Stored lines followed by lines published on the task channel.
+
+    Lines published while the backfill runs arrive on the subscription as
+    well; anything at or below the last id already sent is skipped. The
+    stream ends if the client falls too far behind the shared subscription,
+    and the client resumes from its last event id when it reconnects.
+    """
+    # Subscribe before reading the database so lines saved meanwhile are
+    # buffered by the subscription instead of being lost.
+    subscription = await open_subscription(client, channel_name(task_id))
+    try:
+        cursor = await start_cursor(task_id, after, tail, log_filter)
+        async for message in backfill(task_id, after=cursor, log_filter=log_filter):
+            cursor = message["id"]
+            yield message
+        while True:
+            try:
+                payload = await subscription.get(timeout)
+            except SlowConsumer:
+                logger.warning(f"Closing SSE stream for task {task_id}: client is too slow")
+                return
+            if payload is None:
+                yield None
+                continue
+            try:
+                data = _decode_message(payload)
+            except Exception as exc:
+                logger.error("Error processing pubsub message: %s", exc)
+                continue
+            line_id = data.get("id")
+            if line_id is not None:
+                if line_id <= cursor:
+                    continue
+                cursor = line_id
+            if log_filter and not log_filter.matches(data):
+                continue
+            yield data
+    finally:
+        await subscription.close()
+
+
+async def stream_events(client, task_id, after=0, tail=None, timeout=5, log_filter=None):
+    """Stored lines followed by lines read from the task's Redis stream.
+
+    Stream entries are keyed by row id, so the database only has to supply
+    the lines older than the oldest entry still held in Redis; everything
+    after that is read from the stream with a cursor and nothing is lost or
+    sent twice between the two. Status entries (``<line id>-<n>``) follow
+    the line they were added after.
+    """
+    key = stream_key(task_id)
+    cursor = await start_cursor(task_id, after, tail, log_filter)
+    oldest = await client.xrange(key, count=1)
+    before = None
+    if oldest:
+        line_id, seq = _split_entry_id(oldest[0][0])
+        before = line_id + 1 if seq else line_id
+    if before is None or before > cursor + 1:
+        async for message in backfill(task_id, after=cursor, before=before, log_filter=log_filter):
+            cursor = message["id"]
+            yield message
+
+    position = stream_entry_id(cursor)
+    while True:
+        response = await client.xread({key: position}, count=500, block=int(timeout * 1000))
+        if not response:
+            yield None
+            continue
+        for _key, entries in response:
+            for entry_id, fields in entries:
+                position = entry_id
+                try:
+                    data = _decode_message(fields.get(b"data") or fields.get("data"))
+                except Exception as exc:
+                    logger.error("Error processing stream entry %s: %s", entry_id, exc)
+                    continue
+                if not log_filter or log_filter.matches(data):
+                    yield data
+
+
+def log_events(client, task_id, after=0, tail=None, timeout=5, log_filter=None):
+    """Return the event source for the configured transport."""
+    if get_setting("TRANSPORT") == "stream":
+        source = stream_events
+    else:
+        source = pubsub_events
+    return source(client, task_id, after=after, tail=tail, timeout=timeout, log_filter=log_filter)
+
+
+async def coalesce(events, max_lines=None, window=None, keepalive=5):
+    """Group the messages of an event source into lists for sending.
+
+    A batch holds every message that is ready when the previous one has been
+    sent, up to ``max_lines``. A lone message is sent at once; when more were
+    waiting the source is busy, and the batch keeps filling for up to
+    ``window`` seconds. ``None`` is yielded only after ``keepalive`` seconds
+    without anything to send. The source runs in its own task so that these
+    timeouts never interrupt it in the middle of a message.
+    """
+    max_lines = max_lines or get_setting("SSE_BATCH_LINES")
+    if window is None:
+        window = get_setting("SSE_BATCH_WINDOW") / 1000
+    queue = asyncio.Queue(maxsize=max_lines)
+    done = object()
+
+    async def pump():
+        try:
+            async for message in events:
+                if message is not None:
+                    await queue.put(message)
+        except Exception:
+            logger.exception("SSE event source failed")
+        await queue.put(done)
+
+    loop = asyncio.get_running_loop()
+    task = loop.create_task(pump())
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if message is done:
+                return
+            batch = [message]
+            while len(batch) < max_lines and not queue.empty():
+                batch.append(queue.get_nowait())
+            if len(batch) > 1 and batch[-1] is not done:
+                deadline = loop.time() + window
+                while len(batch) < max_lines:
+                    if queue.empty():
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        try:
+                            batch.append(await asyncio.wait_for(queue.get(), remaining))
+                        except asyncio.TimeoutError:
+                            break
+                    else:
+                        batch.append(queue.get_nowait())
+                    if batch[-1] is done:
+                        break
+            if batch[-1] is done:
+                batch.pop()
+                if batch:
+                    yield batch
+                return
+            yield batch
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await events.aclose()
@@ -0,0 +1,217 @@
+"""Storage backends for captured log lines.
+
+``LineStorage`` keeps one ``TaskLogLine`` row per line. ``SegmentStorage``
+packs consecutive lines of a task into compressed ``TaskLogSegment`` rows,
+which is much smaller for chatty tasks. Both hand lines back as
+``TaskLogLine`` instances whose ``id`` is the cursor used by the SSE stream
+and the paginated API, so readers do not need to know which backend is in
+use. Select the backend with ``CELERY_TASKLOG_STORAGE``.
+"""
+import json
+import zlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+
+from .conf import get_setting
+from .models import TaskLogLine, TaskLogSegment
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+class LineStorage:
+    """One database row per log line."""
+
+    def save(self, lines):
+        TaskLogLine.objects.bulk_create(lines)
+
+    def lines(self, task_id, after=0, before=None, limit=None, reverse=False, stream=None, min_level=None):
+        """Lines of ``task_id`` with ``after < id < before`` in id order.
+
+        ``reverse`` returns them newest first, so that ``limit`` keeps the
+        most recent ones. ``min_level`` keeps only ``logging`` records of at
+        least that level.
+        """
+        queryset = TaskLogLine.objects.filter(task_id=task_id, id__gt=after)
+        if before is not None:
+            queryset = queryset.filter(id__lt=before)
+        if stream:
+            queryset = queryset.filter(stream=stream)
+        if min_level is not None:
+            queryset = queryset.filter(level__gte=min_level)
+        queryset = queryset.order_by("-id" if reverse else "id")
+        if limit is not None:
+            queryset = queryset[:limit]
+        return list(queryset)
+
+    def tail_cursor(self, task_id, after, tail):
+        """Cursor that leaves only the last ``tail`` lines after ``after``."""
+        ids = TaskLogLine.objects.filter(task_id=task_id, id__gt=after).order_by("-id")
+        start = ids.values_list("id", flat=True)[tail - 1:tail].first()
+        return after if start is None else start - 1
+
+
+def _compress(codec, raw):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor().compress(raw)
+    if codec == "zlib":
+        return zlib.compress(raw)
+    return raw
+
+
+def _decompress(codec, data):
+    data = bytes(data)
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    return data
+
+
+def decode_segment(segment):
+    """The lines of a ``TaskLogSegment`` as unsaved ``TaskLogLine`` objects."""
+    raw = _decompress(segment.codec, segment.data)
+    for number, record in enumerate(raw.splitlines(), start=segment.first_line):
+        stream, timestamp, message, *structured = json.loads(record)
+        line = TaskLogLine(
+            id=number,
+            task_id=segment.task_id,
+            stream=stream,
+            message=message,
+            timestamp=datetime.fromtimestamp(timestamp, tz=dt_timezone.utc),
+        )
+        if structured:
+            line.level, line.logger, line.extra = structured
+        yield line
+
+
+class SegmentStorage:
+    """Consecutive lines of a task packed into compressed segments.
+
+    A segment holds up to ``CELERY_TASKLOG_SEGMENT_LINES`` lines or
+    ``CELERY_TASKLOG_SEGMENT_BYTES`` bytes of encoded lines. Each flush tops
+    up the task's last segment before starting new ones, so small, frequent
+    flushes still produce full segments.
+    """
+
+    CODECS = ("zlib", "zstd", "none")
+
+    def __init__(self, codec=None, max_lines=None, max_bytes=None):
+        self.codec = codec or get_setting("COMPRESSION")
+        if self.codec not in self.CODECS:
+            raise ValueError(f"Unknown compression {self.codec!r}, expected one of {self.CODECS}")
+        if self.codec == "zstd" and zstandard is None:
+            raise ImportError("The zstd codec requires the 'zstandard' package")
+        self.max_lines = max_lines or get_setting("SEGMENT_LINES")
+        self.max_bytes = max_bytes or get_setting("SEGMENT_BYTES")
+
+    @staticmethod
+    def _encode_line(line):
+        record = [line.stream, line.timestamp.timestamp(), line.message]
+        if line.level is not None:
+            record += [line.level, line.logger, line.extra]
+        return json.dumps(record).encode() + b"\n"
+
+    def _fill(self, segment, encoded, last_line):
+        """Store ``encoded`` lines in ``segment``, ending with ``last_line``."""
+        raw = b"".join(encoded)
+        segment.last_line = last_line.id
+        segment.last_timestamp = last_line.timestamp
+        segment.line_count = len(encoded)
+        segment.codec = self.codec
+        segment.size = len(raw)
+        segment.data = _compress(self.codec, raw)
+        return segment
+
+    def _has_room(self, count, size):
+        return count < self.max_lines and size < self.max_bytes
+
+    def save(self, lines):
+        by_task = {}
+        for line in lines:
+            by_task.setdefault(line.task_id, []).append(line)
+        now = timezone.now()
+        for task_id, task_lines in by_task.items():
+            with transaction.atomic():
+                self._save_task(task_id, task_lines, now)
+
+    def _save_task(self, task_id, lines, now):
+        last = (
+            TaskLogSegment.objects.select_for_update()
+            .filter(task_id=task_id)
+            .order_by("-first_line")
+            .first()
+        )
+        number = last.last_line if last else 0
+        for line in lines:
+            number += 1
+            line.id = number
+            if line.timestamp is None:
+                line.timestamp = now
+        encoded_lines = [self._encode_line(line) for line in lines]
+
+        index = 0
+        if last and self._has_room(last.line_count, last.size):
+            encoded = _decompress(last.codec, last.data).splitlines(keepends=True)
+            size = last.size
+            while index < len(lines) and self._has_room(len(encoded), size):
+                encoded.append(encoded_lines[index])
+                size += len(encoded_lines[index])
+                index += 1
+            if index:
+                self._fill(last, encoded, lines[index - 1]).save()
+
+        segments = []
+        while index < len(lines):
+            segment = TaskLogSegment(
+                task_id=task_id,
+                first_line=lines[index].id,
+                first_timestamp=lines[index].timestamp,
+            )
+            encoded, size = [], 0
+            while index < len(lines) and (not encoded or self._has_room(len(encoded), size)):
+                encoded.append(encoded_lines[index])
+                size += len(encoded_lines[index])
+                index += 1
+            segments.append(self._fill(segment, encoded, lines[index - 1]))
+        TaskLogSegment.objects.bulk_create(segments)
+
+    def _segments(self, task_id, after, before, reverse):
+        queryset = TaskLogSegment.objects.filter(task_id=task_id, last_line__gt=after)
+        if before is not None:
+            queryset = queryset.filter(first_line__lt=before)
+        return queryset.order_by("-first_line" if reverse else "first_line").iterator(chunk_size=20)
+
+    def lines(self, task_id, after=0, before=None, limit=None, reverse=False, stream=None, min_level=None):
+        result = []
+        for segment in self._segments(task_id, after, before, reverse):
+            decoded = [
+                line for line in decode_segment(segment)
+                if line.id > after
+                and (before is None or line.id < before)
+                and (not stream or line.stream == stream)
+                and (min_level is None or (line.level is not None and line.level >= min_level))
+            ]
+            if reverse:
+                decoded.reverse()
+            result.extend(decoded)
+            if limit is not None and len(result) >= limit:
+                return result[:limit]
+        return result
+
+    def tail_cursor(self, task_id, after, tail):
+        last = TaskLogSegment.objects.filter(task_id=task_id).order_by("-first_line").first()
+        if last is None:
+            return after
+        return max(after, last.last_line - tail)
+
+
+def get_storage():
+    """Return the backend selected by ``CELERY_TASKLOG_STORAGE``."""
+    if get_setting("STORAGE") == "segments":
+        return SegmentStorage()
+    return LineStorage()
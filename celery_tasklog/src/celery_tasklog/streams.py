@@ -0,0 +1,54 @@
+"""Per-task routing of ``sys.stdout`` and ``sys.stderr``.
+
+Swapping ``sys.stdout`` for every task only works while a process runs one
+task at a time. Under Celery's thread, gevent or eventlet pools concurrent
+tasks would overwrite each other's writers. With
+``CELERY_TASKLOG_CONTEXT_STREAMS`` a ``TaskStream`` proxy is installed once
+per process instead, and ``capture_output`` only sets ``active_writers``
+for the current context: each thread, greenlet (gevent 20.12 and later) or
+asyncio task sees the writers of the task it runs, and writes made outside
+any task go to the original stream.
+
+Threads started by a task do not inherit its context; run their target in
+``contextvars.copy_context()`` to capture their output as well.
+"""
+import sys
+from contextvars import ContextVar
+
+# ``(stdout_writer, stderr_writer)`` of the task running in this context.
+active_writers = ContextVar("tasklog_active_writers", default=None)
+
+
+class TaskStream:
+    """Stand-in for ``sys.stdout`` or ``sys.stderr`` routing by context."""
+
+    def __init__(self, index, default):
+        self.index = index
+        self.default = default
+
+    def _target(self):
+        writers = active_writers.get()
+        return self.default if writers is None else writers[self.index]
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def writelines(self, lines):
+        target = self._target()
+        for line in lines:
+            target.write(line)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        # ``encoding``, ``fileno``, ``isatty`` ... of the real stream.
+        return getattr(self.default, name)
+
+
+def install_streams():
+    """Install the ``TaskStream`` proxies, unless they already are."""
+    if not isinstance(sys.stdout, TaskStream):
+        sys.stdout = TaskStream(0, sys.stdout)
+    if not isinstance(sys.stderr, TaskStream):
+        sys.stderr = TaskStream(1, sys.stderr)
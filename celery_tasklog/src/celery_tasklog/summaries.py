@@ -0,0 +1,96 @@
+"""Maintenance of the per-task ``TaskLogSummary`` rows."""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import TaskLogLine, TaskLogSegment, TaskLogSummary
+from .storage import decode_segment
+
+
+def _collect(lines):
+    stats = {}
+    for line in lines:
+        task = stats.get(line.task_id)
+        if task is None:
+            task = stats[line.task_id] = {
+                'line_count': 0,
+                'stdout_count': 0,
+                'stderr_count': 0,
+                'bytes': 0,
+                'first_line_id': line.id,
+                'first_timestamp': line.timestamp,
+            }
+        task['line_count'] += 1
+        if line.stream == 'stdout':
+            task['stdout_count'] += 1
+        elif line.stream == 'stderr':
+            task['stderr_count'] += 1
+        task['bytes'] += len(line.message.encode())
+        task['last_line_id'] = line.id
+        task['last_timestamp'] = line.timestamp
+    return stats
+
+
+COUNTERS = ('line_count', 'stdout_count', 'stderr_count', 'bytes')
+
+
+def update_summaries(lines):
+    """Add a flushed batch of saved lines to their tasks' summaries.
+
+    One ``UPDATE`` per task in the batch; the row is created on the task's
+    first flush.
+    """
+    for task_id, task in _collect(lines).items():
+        changes = {name: F(name) + task[name] for name in COUNTERS}
+        changes.update(last_line_id=task['last_line_id'], last_timestamp=task['last_timestamp'])
+        if TaskLogSummary.objects.filter(task_id=task_id).update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                TaskLogSummary.objects.create(task_id=task_id, **task)
+        except IntegrityError:
+            # Another writer created the row first.
+            TaskLogSummary.objects.filter(task_id=task_id).update(**changes)
+
+
+def _stored_lines(task_id):
+    yield from TaskLogLine.objects.filter(task_id=task_id).order_by('id').iterator()
+    segments = TaskLogSegment.objects.filter(task_id=task_id).order_by('first_line')
+    for segment in segments.iterator():
+        yield from decode_segment(segment)
+
+
+def refresh_summaries(task_ids):
+    """Recompute the summaries of ``task_ids`` from the stored lines.
+
+    Used after lines were deleted; tasks without lines lose their summary.
+    """
+    for task_id in task_ids:
+        task = _collect(_stored_lines(task_id)).get(task_id)
+        if task is None:
+            TaskLogSummary.objects.filter(task_id=task_id).delete()
+        else:
+            TaskLogSummary.objects.update_or_create(task_id=task_id, defaults=task)
+
+
+def get_summaries(task_ids=None, limit=None):
+    """Log metrics per task as ``{task_id: {...}}``.
+
+    Returns the summaries of ``task_ids``, or of the ``limit`` tasks that
+    logged most recently.
+    """
+    queryset = TaskLogSummary.objects.order_by('-last_timestamp')
+    if task_ids is not None:
+        queryset = queryset.filter(task_id__in=list(task_ids))
+    if limit is not None:
+        queryset = queryset[:limit]
+    return {
+        summary.task_id: {
+            'log_count': summary.line_count,
+            'stdout_count': summary.stdout_count,
+            'stderr_count': summary.stderr_count,
+            'bytes': summary.bytes,
+            'first_log_at': summary.first_timestamp,
+            'last_log_at': summary.last_timestamp,
+        }
+        for summary in queryset
+    }
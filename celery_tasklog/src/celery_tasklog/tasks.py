@@ -1,48 +1,217 @@
 import sys
 from contextlib import contextmanager
 
-from celery import Task
+from celery import Task, shared_task
+from .buffers import BackgroundLogBuffer, LimitedLogBuffer, LogBuffer
+from .conf import get_setting
+from .fdcapture import FDCapture
+from .handlers import active_capture, install_handler
 from .models import TaskLogLine
+from .publishing import publish_status
+from .pruning import prune_expired, trim_tasks
+from .spool import SpoolBuffer
+from .streams import active_writers, install_streams
 
 
 class DBLogWriter:
-    def __init__(self, task_id: str, stream: str):
+    """File-like object turning written text into ``TaskLogLine`` rows.
+
+    Text is split on ``\\n`` in one pass per ``write`` and the unfinished
+    line is kept as a list of pieces, so large writes cost linear time.
+    A carriage return starts the line over, as in a terminal: progress bars
+    redrawn with ``\\r`` are stored once, in their final state, and
+    ``\\r\\n`` ends a line normally. At most ``max_line_length``
+    characters of a line are kept in memory; the cut is reported to a
+    ``LimitedLogBuffer``, which every other buffer is wrapped in.
+    """
+
+    def __init__(self, task_id: str, stream: str, log_buffer=None):
+        if log_buffer is None:
+            log_buffer = LogBuffer()
+        if not isinstance(log_buffer, LimitedLogBuffer):
+            log_buffer = LimitedLogBuffer(log_buffer, task_id)
         self.task_id = task_id
         self.stream = stream
-        self.buffer = ""
+        self.log_buffer = log_buffer
+        self.max_line_length = log_buffer.max_line_length
+        self._pieces = []
+        self._length = 0
+        self._truncated = 0
+        # The last character written was a carriage return.
+        self._carriage = False
+        # The current line has been redrawn, so it is not flushed unfinished.
+        self._redrawn = False
+
+    def _emit(self, line: str, truncated=0):
+        self.log_buffer.add(TaskLogLine(task_id=self.task_id, stream=self.stream, message=line), truncated)
+
+    def _restart(self):
+        self._pieces = []
+        self._length = 0
+        self._truncated = 0
+        self._redrawn = True
+
+    def _append(self, text: str):
+        if not text:
+            return
+        body = text.rstrip("\r")
+        if body:
+            if self._carriage:
+                self._restart()
+            if "\r" in body:
+                self._restart()
+                body = body.rpartition("\r")[2]
+            if self.max_line_length:
+                room = self.max_line_length - self._length
+                if len(body) > room:
+                    self._truncated += len(body) - max(room, 0)
+                    body = body[:max(room, 0)]
+            if body:
+                self._pieces.append(body)
+                self._length += len(body)
+        self._carriage = text.endswith("\r")
+
+    def _end_line(self):
+        if self._pieces:
+            self._emit("".join(self._pieces), self._truncated)
+        self._pieces = []
+        self._length = 0
+        self._truncated = 0
+        self._carriage = False
+        self._redrawn = False
 
     def write(self, msg: str):
-        self.buffer += msg
-        while "\n" in self.buffer:
-            line, self.buffer = self.buffer.split("\n", 1)
-            if line:
-                TaskLogLine.objects.create(task_id=self.task_id, stream=self.stream, message=line)
+        *lines, rest = msg.split("\n")
+        for line in lines:
+            self._append(line)
+            self._end_line()
+        self._append(rest)
+        return len(msg)
 
     def flush(self):
-        if self.buffer:
-            TaskLogLine.objects.create(task_id=self.task_id, stream=self.stream, message=self.buffer)
-            self.buffer = ""
+        # An unfinished progress line is kept until it is completed.
+        if not self._redrawn:
+            self._end_line()
+        self.log_buffer.flush()
+
+    def close(self):
+        """Store the unfinished line, even a progress line."""
+        self._end_line()
+        self.log_buffer.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
 
 
 @contextmanager
-def capture_output(task_id: str):
-    stdout_writer = DBLogWriter(task_id, "stdout")
-    stderr_writer = DBLogWriter(task_id, "stderr")
+def capture_output(
+    task_id: str,
+    batch_size: int = None,
+    flush_interval: int = None,
+    background: bool = None,
+    capture_fds: bool = None,
+):
+    """Store what the task writes to stdout/stderr (and logs) as ``task_id``.
+
+    With ``capture_fds`` (default ``CELERY_TASKLOG_CAPTURE_FDS``) file
+    descriptors 1 and 2 are redirected as well, so output of subprocesses,
+    C extensions and ``os.write`` is captured; their lines are read by a
+    thread and therefore always go through the background writer.
+
+    With ``CELERY_TASKLOG_CONTEXT_STREAMS`` the writers are only set for the
+    current context, behind the proxies of ``streams.install_streams``,
+    instead of replacing ``sys.stdout`` and ``sys.stderr`` for the process.
+    """
+    if capture_fds is None:
+        capture_fds = get_setting("CAPTURE_FDS")
+    if background is None:
+        background = get_setting("BACKGROUND")
+    background = background or capture_fds
+    # Both streams share one buffer so stdout and stderr lines keep their
+    # relative order when they are written in batches.
+    if get_setting("SPOOL_DIR"):
+        # Lines go to the worker's spool; its shipper batches the inserts.
+        task_buffer = SpoolBuffer()
+    else:
+        buffer_class = BackgroundLogBuffer if background else LogBuffer
+        task_buffer = buffer_class(batch_size=batch_size, flush_interval=flush_interval)
+    # The limits are per task, so they are shared by all writers too.
+    log_buffer = LimitedLogBuffer(task_buffer, task_id)
+    stdout_writer = DBLogWriter(task_id, "stdout", log_buffer)
+    stderr_writer = DBLogWriter(task_id, "stderr", log_buffer)
+    if get_setting("CAPTURE_LOGGING"):
+        install_handler()
+    capture_token = active_capture.set((task_id, log_buffer))
+    context_streams = get_setting("CONTEXT_STREAMS")
+    if context_streams:
+        install_streams()
     old_stdout = sys.stdout
     old_stderr = sys.stderr
-    sys.stdout = stdout_writer
-    sys.stderr = stderr_writer
+    fd_captures = []
+    if capture_fds:
+        # Output already buffered for the real descriptors is not the task's.
+        old_stdout.flush()
+        old_stderr.flush()
+        for fd, stream in ((1, "stdout"), (2, "stderr")):
+            fd_captures.append(FDCapture(fd, DBLogWriter(task_id, stream, log_buffer)).start())
+    if context_streams:
+        writers_token = active_writers.set((stdout_writer, stderr_writer))
+    else:
+        sys.stdout = stdout_writer
+        sys.stderr = stderr_writer
     try:
         yield
     finally:
-        stdout_writer.flush()
-        stderr_writer.flush()
-        sys.stdout = old_stdout
-        sys.stderr = old_stderr
+        try:
+            active_capture.reset(capture_token)
+            if context_streams:
+                active_writers.reset(writers_token)
+            for fd_capture in fd_captures:
+                fd_capture.stop()
+            stdout_writer.close()
+            stderr_writer.close()
+            log_buffer.close()
+        finally:
+            if not context_streams:
+                sys.stdout = old_stdout
+                sys.stderr = old_stderr
 
 
 class TerminalLoggingTask(Task):
+    # Per-task overrides for CELERY_TASKLOG_BATCH_SIZE / _FLUSH_INTERVAL /
+    # _BACKGROUND.
+    tasklog_batch_size = None
+    tasklog_flush_interval = None
+    tasklog_background = None
+    # Per-task override for CELERY_TASKLOG_CAPTURE_FDS.
+    tasklog_capture_fds = None
+
     def __call__(self, *args, **kwargs):
         task_id = self.request.id
-        with capture_output(task_id):
+        with capture_output(
+            task_id,
+            batch_size=self.tasklog_batch_size,
+            flush_interval=self.tasklog_flush_interval,
+            background=self.tasklog_background,
+            capture_fds=self.tasklog_capture_fds,
+        ):
             return self.run(*args, **kwargs)
+
+    def update_state(self, task_id=None, state=None, meta=None, **kwargs):
+        super().update_state(task_id=task_id, state=state, meta=meta, **kwargs)
+        # Push the new state (e.g. PROGRESS with its meta) to SSE clients.
+        publish_status(task_id or self.request.id, state, meta=meta)
+
+
+@shared_task(name="celery_tasklog.prune_task_logs")
+def prune_task_logs(retention_days=None, max_lines=None, batch_size=None):
+    """Periodic task applying the retention settings; schedule it with beat."""
+    expired = prune_expired(retention_days, batch_size)
+    trimmed = trim_tasks(max_lines, batch_size)
+    return {
+        'expired': {'deleted': expired.deleted, 'rows_per_sec': expired.rows_per_sec},
+        'trimmed': {'deleted': trimmed.deleted, 'rows_per_sec': trimmed.rows_per_sec},
+    }
@@ -7,11 +7,15 @@ app_name = 'celery_tasklog'
 api_urlpatterns = [
     path('tasks/', api_views.TaskListView.as_view(), name='task_list'),
     path('tasks/<str:task_id>/', api_views.TaskDetailView.as_view(), name='task_detail'),
+    path('tasks/<str:task_id>/logs/', api_views.TaskLogListView.as_view(), name='task_logs'),
+    path('logs/search/', api_views.LogSearchView.as_view(), name='log_search'),
+    path('streams/<str:session>/', api_views.StreamControlView.as_view(), name='stream_control'),
 ]
 
 # SSE URLs for real-time log streaming (reusable by any app)
 sse_urlpatterns = [
     path('task/<str:task_id>/', api_views.task_log_stream, name='task_log_stream'),
+    path('tasks/', api_views.tasks_log_stream, name='tasks_log_stream'),
     path('test/', api_views.test_sse, name='test_sse'),
 ]
 
@@ -19,6 +23,7 @@ urlpatterns = [
     # Basic task log views
     path('task/<str:task_id>/', views.task_log_view, name='task_log'),
     path('diagnostic/', views.task_diagnostic, name='task_diagnostic'),
+    path('metrics/', views.metrics_view, name='metrics'),
     
     # API endpoints (reusable)
     path('api/', include(api_urlpatterns)),
@@ -1,11 +1,21 @@
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
-from .models import TaskLogLine
+from . import metrics
+from .conf import get_setting
+from .storage import get_storage
 
 
 def task_log_view(request, task_id):
-    logs = TaskLogLine.objects.filter(task_id=task_id).order_by('timestamp')
+    logs = get_storage().lines(task_id)
     return render(request, 'celery_tasklog/task_view.html', {'logs': logs, 'task_id': task_id})
 
 
 def task_diagnostic(request):
     return render(request, 'celery_tasklog/diagnostic.html')
+
+
+def metrics_view(request):
+    """Metrics of this process in the Prometheus text format."""
+    if get_setting("METRICS") != "prometheus":
+        raise Http404("Metrics are not exported to Prometheus")
+    return HttpResponse(metrics.get_sink().render(), content_type="text/plain; version=0.0.4")
@@ -0,0 +1,60 @@
+import importlib.util
+import sys
+import os
+import pathlib
+import fakeredis
+import pytest
+
+# Import the app from the package src directory under its real name. The
+# repository root also contains a ``celery_tasklog`` directory (the Poetry
+# project), which would otherwise shadow it.
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+PACKAGE_PATH = ROOT / "celery_tasklog" / "src" / "celery_tasklog"
+spec = importlib.util.spec_from_file_location(
+    "celery_tasklog",
+    PACKAGE_PATH / "__init__.py",
+    submodule_search_locations=[str(PACKAGE_PATH)],
+)
+celery_pkg = importlib.util.module_from_spec(spec)
+sys.modules["celery_tasklog"] = celery_pkg
+spec.loader.exec_module(celery_pkg)
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djproject.settings")
+import django
+from django.conf import settings
+
+settings.DATABASES["default"] = {
+    "ENGINE": "django.db.backends.sqlite3",
+    "NAME": ":memory:",
+}
+# Tests run inside a transaction of the main thread's connection, which the
+# SSE read pool's own connections cannot see; see
+# ``test_read_pool_runs_backfills_concurrently``.
+settings.CELERY_TASKLOG_SSE_READ_THREADS = 0
+
+django.setup()
+
+
+@pytest.fixture
+def fake_redis_server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch, fake_redis_server):
+    """Replace the Redis client used for publishing with an in-memory fake."""
+    import celery_tasklog.publishing as publishing
+
+    client = fakeredis.FakeRedis(server=fake_redis_server)
+    monkeypatch.setattr(publishing, "redis_client", client)
+    return client
+
+
+@pytest.fixture(autouse=True)
+def fake_async_redis(monkeypatch, fake_redis_server):
+    """Replace the async Redis client used by the SSE views with a fake."""
+    import celery_tasklog.api_views as api_views
+
+    client = fakeredis.FakeAsyncRedis(server=fake_redis_server)
+    monkeypatch.setattr(api_views, "redis_client", client)
+    return client
@@ -0,0 +1,153 @@
+import pytest
+from rest_framework.test import APIClient
+
+from celery_tasklog.models import TaskLogLine
+from celery_tasklog.summaries import update_summaries
+
+
+@pytest.fixture
+def lines():
+    task_id = "api-test"
+    TaskLogLine.objects.bulk_create(
+        [
+            TaskLogLine(task_id=task_id, stream="stderr" if i % 3 == 0 else "stdout", message=f"line {i}")
+            for i in range(10)
+        ]
+    )
+    return list(TaskLogLine.objects.filter(task_id=task_id).order_by("id"))
+
+
+@pytest.mark.django_db
+def test_task_logs_pages_by_cursor(lines):
+    client = APIClient()
+    url = "/tasklog/api/tasks/api-test/logs/"
+
+    newest = client.get(url, {"limit": 4}).json()
+    assert [log["message"] for log in newest["results"]] == ["line 6", "line 7", "line 8", "line 9"]
+    assert f"before={lines[6].id}" in newest["previous"]
+
+    older = client.get(newest["previous"]).json()
+    assert [log["message"] for log in older["results"]] == ["line 2", "line 3", "line 4", "line 5"]
+
+    first = client.get(url, {"after": 0, "limit": 4}).json()
+    assert [log["message"] for log in first["results"]] == ["line 0", "line 1", "line 2", "line 3"]
+    assert f"after={lines[3].id}" in first["next"]
+
+    last = client.get(url, {"after": lines[7].id, "limit": 4}).json()
+    assert [log["message"] for log in last["results"]] == ["line 8", "line 9"]
+    assert last["next"] is None
+
+
+@pytest.mark.django_db
+def test_task_logs_filters_stream_and_validates(lines):
+    client = APIClient()
+    url = "/tasklog/api/tasks/api-test/logs/"
+
+    stderr = client.get(url, {"stream": "stderr", "after": 0}).json()
+    assert [log["message"] for log in stderr["results"]] == ["line 0", "line 3", "line 6", "line 9"]
+    assert client.get(url, {"limit": "many"}).status_code == 400
+    assert client.get(url, {"limit": 0}).status_code == 400
+
+
+def make_tasks(count, with_results=True, start=0):
+    import json
+
+    from django_celery_results.models import TaskResult
+
+    for i in range(start, start + count):
+        task_id = f"task-{i}"
+        update_summaries(
+            TaskLogLine.objects.bulk_create(
+                [TaskLogLine(task_id=task_id, stream="stdout", message=f"{task_id} line {n}") for n in range(3)]
+            )
+        )
+        if with_results:
+            TaskResult.objects.create(
+                task_id=task_id, task_name="demo", status="PROGRESS", result=json.dumps({"progress": i})
+            )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("with_results", [True, False])
+def test_task_list_query_count_is_constant(
+    django_assert_num_queries, django_assert_max_num_queries, with_results
+):
+    client = APIClient()
+    make_tasks(2, with_results)
+    with django_assert_max_num_queries(3) as small:
+        client.get("/tasklog/api/tasks/")
+    make_tasks(18, with_results, start=2)
+    with django_assert_num_queries(len(small.captured_queries)):
+        tasks = client.get("/tasklog/api/tasks/").json()
+
+    assert len(tasks) == 20
+    task = next(t for t in tasks if t["task_id"] == "task-7")
+    assert task["log_count"] == 3
+    if with_results:
+        assert (task["status"], task["progress"]) == ("PROGRESS", 7)
+
+
+@pytest.mark.django_db
+def test_task_detail_prefers_task_result(monkeypatch):
+    from celery import current_app
+
+    make_tasks(1)
+
+    def no_backend(task_id):
+        raise AssertionError("result backend should not be queried")
+
+    monkeypatch.setattr(current_app, "AsyncResult", no_backend)
+    task = APIClient().get("/tasklog/api/tasks/task-0/").json()
+    assert task["status"] == "PROGRESS"
+    assert task["log_count"] == 3
+    assert [log["message"] for log in task["logs"]] == [f"task-0 line {n}" for n in range(3)]
+
+
+@pytest.mark.django_db
+def test_log_search_returns_hits_with_context():
+    from celery_tasklog.search import FTS5Search, get_search_backend
+
+    assert isinstance(get_search_backend(), FTS5Search)
+    for task_id in ("search-a", "search-b"):
+        TaskLogLine.objects.bulk_create(
+            [
+                TaskLogLine(task_id=task_id, stream="stdout", message=f"{task_id} step {i}" if i != 5 else "Connection REFUSED")
+                for i in range(10)
+            ]
+        )
+    TaskLogLine.objects.filter(task_id="search-a", message="Connection REFUSED").update(message="retrying")
+
+    client = APIClient()
+    url = "/tasklog/api/logs/search/"
+    page = client.get(url, {"q": "refused", "context": 1, "limit": 1}).json()
+    assert [hit["task_id"] for hit in page["results"]] == ["search-b"]
+    hit = page["results"][0]
+    assert [line["message"] for line in hit["context_before"]] == ["search-b step 4"]
+    assert [line["message"] for line in hit["context_after"]] == ["search-b step 6"]
+    assert page["next"] is None
+
+    page = client.get(url, {"q": "step 1", "limit": 1}).json()
+    assert page["results"][0]["message"] == "search-b step 1"
+    page = client.get(page["next"]).json()
+    assert page["results"][0]["message"] == "search-a step 1"
+
+    assert client.get(url, {"q": "retry", "task_id": "search-b"}).json()["results"] == []
+    assert client.get(url, {"q": "step", "since": "2999-01-01"}).json()["results"] == []
+    assert client.get(url, {"q": "step", "since": "yesterday"}).status_code == 400
+    assert client.get(url).status_code == 400
+
+
+@pytest.mark.django_db
+def test_task_logs_filter_by_logging_level():
+    TaskLogLine.objects.bulk_create([
+        TaskLogLine(task_id="level-test", stream="stdout", message="output"),
+        TaskLogLine(task_id="level-test", stream="log", message="info", level=20, logger="app"),
+        TaskLogLine(task_id="level-test", stream="log", message="error", level=40, logger="app", extra={"k": 1}),
+    ])
+    client = APIClient()
+    url = "/tasklog/api/tasks/level-test/logs/"
+
+    errors = client.get(url, {"level": "error"}).json()["results"]
+    assert [(log["message"], log["logger"], log["extra"]) for log in errors] == [("error", "app", {"k": 1})]
+    assert len(client.get(url, {"level": 20}).json()["results"]) == 2
+    assert client.get(url, {"level": "loud"}).status_code == 400
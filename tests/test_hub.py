@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from asgiref.sync import async_to_sync
+
+from celery_tasklog.hub import SlowConsumer, Subscription, SubscriptionHub
+
+
+def test_hub_shares_one_connection_between_subscribers(fake_async_redis, monkeypatch):
+    opened = []
+    pubsub = fake_async_redis.pubsub
+
+    def counting_pubsub(*args, **kwargs):
+        opened.append(1)
+        return pubsub(*args, **kwargs)
+
+    monkeypatch.setattr(fake_async_redis, "pubsub", counting_pubsub)
+
+    async def scenario():
+        hub = SubscriptionHub(fake_async_redis, queue_size=10, policy="disconnect")
+        first = await hub.subscribe("tasklog:a")
+        second = await hub.subscribe("tasklog:a")
+        other = await hub.subscribe("tasklog:b")
+        await fake_async_redis.publish("tasklog:a", b"hello")
+        received = [await first.get(2), await second.get(2), await other.get(0.2)]
+        for subscription in (first, second, other):
+            await subscription.close()
+        return received, hub
+
+    received, hub = async_to_sync(scenario)()
+    assert received == [b"hello", b"hello", None]
+    assert len(opened) == 1
+    assert hub.subscriptions == {}
+
+
+def test_slow_consumer_policies():
+    async def scenario():
+        hub = SubscriptionHub(client=None)
+        dropping = Subscription(hub, "tasklog:a", maxsize=2, policy="drop_oldest")
+        disconnecting = Subscription(hub, "tasklog:a", maxsize=2, policy="disconnect")
+        for i in range(3):
+            dropping.deliver(i)
+            disconnecting.deliver(i)
+        assert [await dropping.get(0), await dropping.get(0)] == [1, 2]
+        assert dropping.dropped == 1
+        with pytest.raises(SlowConsumer):
+            await disconnecting.get(0)
+
+    async_to_sync(scenario)()
+    with pytest.raises(ValueError):
+        Subscription(None, "tasklog:a", maxsize=1, policy="ignore")
@@ -0,0 +1,300 @@
+import json
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory
+
+from celery_tasklog.api_views import task_log_stream
+from celery_tasklog.buffers import save_log_lines
+from celery_tasklog.models import TaskLogLine
+
+
+def save_lines(task_id, *messages):
+    return save_log_lines(
+        [TaskLogLine(task_id=task_id, stream="stdout", message=m) for m in messages]
+    )
+
+
+def parse_frames(chunk):
+    """Split an SSE chunk into ``(fields, data)`` per event."""
+    if isinstance(chunk, bytes):
+        chunk = chunk.decode()
+    for block in filter(None, chunk.split("\n\n")):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        yield fields, json.loads(fields["data"])
+
+
+def read_events(task_id, count, during=None, params=None, during_at=1, frames=None, **headers):
+    """Collect ``count`` non-keepalive events from the SSE view.
+
+    ``during`` is called once ``during_at`` events have been received, i.e.
+    while the stream is open, to simulate lines written by a running task.
+    Lines of batched ``logs`` events are collected one by one; the raw
+    events are appended to ``frames`` when it is given.
+    """
+
+    async def collect():
+        request = RequestFactory().get(f"/tasklog/sse/task/{task_id}/", params, **headers)
+        response = await task_log_stream(request, task_id)
+        events = []
+        called = False
+        stream = response.streaming_content
+        try:
+            async for chunk in stream:
+                for fields, data in parse_frames(chunk):
+                    if frames is not None:
+                        frames.append(fields)
+                    for message in data if isinstance(data, list) else [data]:
+                        if message["type"] != "keepalive":
+                            events.append(message)
+                if during and not called and len(events) >= during_at:
+                    called = True
+                    await during()
+                if len(events) >= count:
+                    break
+        finally:
+            await stream.aclose()
+        return events
+
+    return async_to_sync(collect)()
+
+
+@pytest.mark.django_db
+def test_stream_transport_backfills_then_reads_stream(settings):
+    from asgiref.sync import sync_to_async
+
+    settings.CELERY_TASKLOG_TRANSPORT = "stream"
+    settings.CELERY_TASKLOG_STREAM_MAXLEN = 2
+    task_id = "stream-test"
+    save_lines(task_id, "one", "two", "three", "four")
+
+    async def write_more():
+        await sync_to_async(save_lines)(task_id, "five")
+
+    events = read_events(task_id, 6, during=write_more)
+    assert events[0]["type"] == "connected"
+    assert [e["message"] for e in events[1:]] == ["one", "two", "three", "four", "five"]
+    ids = [e["id"] for e in events[1:]]
+    assert ids == sorted(ids)
+
+
+@pytest.mark.django_db
+def test_resume_from_last_event_id_skips_duplicates(fake_redis):
+    from asgiref.sync import sync_to_async
+
+    task_id = "resume-test"
+    first, second = save_lines(task_id, "first", "second")
+
+    async def write_more():
+        # A line already sent from the database arrives again on the
+        # subscription, followed by a genuinely new one.
+        await sync_to_async(fake_redis.publish)(
+            f"tasklog:{task_id}",
+            json.dumps({"type": "new_log", "id": second.id, "message": "second"}),
+        )
+        await sync_to_async(save_lines)(task_id, "third")
+
+    events = read_events(task_id, 3, during=write_more, HTTP_LAST_EVENT_ID=str(first.id))
+    assert [e.get("message") for e in events[1:]] == ["second", "third"]
+
+
+def test_format_event_includes_line_id():
+    from celery_tasklog.sse import format_event, parse_cursor
+
+    assert format_event({"type": "new_log", "id": 7}).startswith("id: 7\ndata: ")
+    assert format_event({"type": "connected"}).startswith("data: ")
+    assert parse_cursor("12") == 12
+    assert parse_cursor("nope") == 0
+    assert parse_cursor(None) == 0
+
+
+@pytest.mark.django_db
+def test_backfill_reads_in_chunks_and_honours_tail(settings, django_assert_num_queries):
+    from celery_tasklog.sse import backfill
+
+    settings.CELERY_TASKLOG_BACKFILL_CHUNK_SIZE = 2
+    task_id = "chunk-test"
+    save_lines(task_id, *[f"line {i}" for i in range(5)])
+
+    async def collect():
+        return [m["message"] async for m in backfill(task_id)]
+
+    with django_assert_num_queries(3):
+        assert async_to_sync(collect)() == [f"line {i}" for i in range(5)]
+
+    events = read_events(task_id, 4, QUERY_STRING="tail=3")
+    assert [e["message"] for e in events[1:]] == ["line 2", "line 3", "line 4"]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("transport", ["pubsub", "stream"])
+def test_stream_and_grep_filters_apply_to_backfill_and_live_lines(settings, transport):
+    from asgiref.sync import sync_to_async
+
+    settings.CELERY_TASKLOG_TRANSPORT = transport
+    settings.CELERY_TASKLOG_BACKFILL_CHUNK_SIZE = 2
+    task_id = f"filter-{transport}"
+
+    def write(*lines):
+        return save_log_lines([TaskLogLine(task_id=task_id, stream=s, message=m) for s, m in lines])
+
+    write(
+        ("stderr", "ERROR old"),
+        ("stderr", "ERROR disk full"),
+        ("stdout", "ERROR on stdout"),
+        ("stderr", "warning"),
+        ("stdout", "ok"),
+    )
+
+    async def write_more():
+        await sync_to_async(write)(("stdout", "ERROR live stdout"), ("stderr", "fine"), ("stderr", "ERROR live"))
+
+    events = read_events(
+        task_id, 3, during=write_more, during_at=2, params={"stream": "stderr", "grep": "^ERROR", "tail": 1}
+    )
+    assert [e["message"] for e in events[1:]] == ["ERROR disk full", "ERROR live"]
+
+
+@pytest.mark.django_db
+def test_invalid_filters_are_rejected():
+    request = RequestFactory().get("/tasklog/sse/task/x/", {"grep": "("})
+    assert async_to_sync(task_log_stream)(request, "x").status_code == 400
+    request = RequestFactory().get("/tasklog/sse/task/x/", {"stream": "stdin"})
+    assert async_to_sync(task_log_stream)(request, "x").status_code == 400
+
+
+def test_coalesce_batches_ready_messages_and_keeps_alive_only_when_idle():
+    import asyncio
+
+    from celery_tasklog.sse import coalesce
+
+    async def source():
+        for i in range(5):
+            yield {"type": "new_log", "id": i}
+        yield None  # idle timeout of the source, not forwarded
+        await asyncio.sleep(0.05)
+        yield {"type": "new_log", "id": 5}
+
+    async def collect():
+        return [
+            batch and [m["id"] for m in batch]
+            async for batch in coalesce(source(), max_lines=3, window=0, keepalive=0.02)
+        ]
+
+    batches = async_to_sync(collect)()
+    # The queue holds at most ``max_lines`` messages, which are sent together.
+    assert batches[:2] == [[0, 1, 2], [3, 4]]
+    assert batches[2:-1] and all(batch is None for batch in batches[2:-1])
+    assert batches[-1] == [5]
+
+
+@pytest.mark.django_db
+def test_batch_mode_sends_logs_events_with_raw_lines(fake_redis):
+    from asgiref.sync import sync_to_async
+
+    task_id = "batch-test"
+    first, second = save_lines(task_id, "one", "two")
+    raw = json.dumps({"type": "new_log", "id": second.id + 1, "task_id": task_id, "message": "three"})
+
+    async def publish():
+        await sync_to_async(fake_redis.publish)(f"tasklog:{task_id}", raw)
+
+    frames = []
+    events = read_events(task_id, 4, during=publish, during_at=3, params={"batch": "1"}, frames=frames)
+    assert [e["message"] for e in events[1:]] == ["one", "two", "three"]
+    assert (frames[1]["id"], frames[1]["event"]) == (str(second.id), "logs")
+    assert json.loads(frames[1]["data"]) == ([
+        {"type": "new_log", "id": first.id, "timestamp": first.timestamp.isoformat(), "stream": "stdout",
+         "message": "one", "task_id": task_id},
+        {"type": "new_log", "id": second.id, "timestamp": second.timestamp.isoformat(), "stream": "stdout",
+         "message": "two", "task_id": task_id},
+    ])
+    assert frames[2]["data"] == f"[{raw}]"
+
+
+@pytest.mark.django_db
+def test_status_events_are_ordered_between_lines_in_streams(settings, fake_redis):
+    from celery_tasklog.publishing import publish_status
+
+    settings.CELERY_TASKLOG_TRANSPORT = "stream"
+    task_id = "status-stream"
+    publish_status(task_id, "STARTED")
+    save_lines(task_id, "one", "two")
+    publish_status(task_id, "PROGRESS", meta={"progress": 40})
+    publish_status(task_id, "PROGRESS", meta={"progress": 80})
+    save_lines(task_id, "three")
+
+    events = read_events(task_id, 7)
+    assert [(e["type"], e.get("message"), e.get("progress")) for e in events[1:]] == [
+        ("status", None, None),
+        ("new_log", "one", None),
+        ("new_log", "two", None),
+        ("status", None, 40),
+        ("status", None, 80),
+        ("new_log", "three", None),
+    ]
+
+    # Once the lines before a status entry were trimmed from the stream they
+    # come from the database.
+    fake_redis.xtrim(f"tasklog:stream:{task_id}", maxlen=3, approximate=False)
+    events = read_events(task_id, 6)
+    assert [(e["type"], e.get("message"), e.get("progress")) for e in events[1:]] == [
+        ("new_log", "one", None),
+        ("new_log", "two", None),
+        ("status", None, 40),
+        ("status", None, 80),
+        ("new_log", "three", None),
+    ]
+
+
+def test_status_entries_follow_the_newest_line():
+    from celery_tasklog.publishing import _next_status_entry_id
+
+    assert _next_status_entry_id(None) == "0-1"
+    assert _next_status_entry_id(b"12-0") == "12-1"
+    assert _next_status_entry_id("12-1") == "12-2"
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("threads, expected_peak", [(4, 2), (0, 1)])
+def test_read_pool_runs_backfills_concurrently(settings, monkeypatch, threads, expected_peak):
+    import asyncio
+    import threading
+    import time
+
+    from celery_tasklog.sse import backfill
+    from celery_tasklog.storage import LineStorage
+
+    settings.CELERY_TASKLOG_SSE_READ_THREADS = threads
+    save_lines("pool-a", "a1", "a2")
+    save_lines("pool-b", "b1")
+
+    lock = threading.Lock()
+    active, peak, threads_used = 0, 0, set()
+    lines = LineStorage.lines
+
+    def slow_lines(self, *args, **kwargs):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+            threads_used.add(threading.current_thread().name)
+        time.sleep(0.1)
+        try:
+            return lines(self, *args, **kwargs)
+        finally:
+            with lock:
+                active -= 1
+
+    monkeypatch.setattr(LineStorage, "lines", slow_lines)
+
+    async def read(task_id):
+        return [m["message"] async for m in backfill(task_id)]
+
+    async def read_both():
+        return await asyncio.gather(read("pool-a"), read("pool-b"))
+
+    assert async_to_sync(read_both)() == [["a1", "a2"], ["b1"]]
+    assert peak == expected_peak
+    if threads:
+        assert all(name.startswith("tasklog-read") for name in threads_used)
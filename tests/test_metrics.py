@@ -0,0 +1,75 @@
+import socket
+
+import pytest
+
+from celery_tasklog import metrics
+from celery_tasklog.buffers import BackgroundLogBuffer, LimitedLogBuffer
+from celery_tasklog.models import TaskLogLine
+from celery_tasklog.tasks import capture_output
+
+
+def test_metrics_are_disabled_by_default():
+    assert metrics.get_sink() is None
+    assert metrics.start_timer() is None
+    metrics.increment("lines_written_total")
+    metrics.observe_since("flush_seconds", None)
+
+
+@pytest.mark.django_db
+def test_registry_counts_flushes_drops_and_publishes(settings):
+    settings.CELERY_TASKLOG_METRICS = "registry"
+    registry = metrics.get_sink()
+
+    with capture_output("metrics-test", batch_size=10, flush_interval=60000):
+        for i in range(25):
+            print(f"line {i}")
+
+    assert registry.value("lines_written_total") == 25
+    assert registry.value("flush_lines") == (3, 25)
+    assert registry.value("flush_seconds")[0] == 3
+    assert registry.value("publish_seconds", transport="pubsub")[0] == 3
+
+    limited = LimitedLogBuffer(BackgroundLogBuffer(max_queue=1, policy="drop", flush_interval=60000), "m", max_bytes=3)
+    limited.add(TaskLogLine(task_id="m", stream="stdout", message="abcd"))
+    limited.log_buffer.close()
+    assert registry.value("lines_dropped_total", reason="quota") == 1
+
+
+@pytest.mark.django_db
+def test_prometheus_endpoint_renders_registry(client, settings):
+    assert client.get("/tasklog/metrics/").status_code == 404
+
+    settings.CELERY_TASKLOG_METRICS = "prometheus"
+    metrics.increment("lines_dropped_total", 2, reason="backpressure")
+    metrics.add("sse_connections", 1)
+    metrics.observe("flush_seconds", 0.003)
+
+    response = client.get("/tasklog/metrics/")
+    assert response["Content-Type"].startswith("text/plain")
+    text = response.content.decode()
+    assert "# TYPE celery_tasklog_lines_dropped_total counter" in text
+    assert 'celery_tasklog_lines_dropped_total{reason="backpressure"} 2' in text
+    assert "celery_tasklog_sse_connections 1" in text
+    assert 'celery_tasklog_flush_seconds_bucket{le="0.0025"} 0' in text
+    assert 'celery_tasklog_flush_seconds_bucket{le="0.005"} 1' in text
+    assert "celery_tasklog_flush_seconds_count 1" in text
+
+
+def test_statsd_sink_sends_packets(settings):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(1)
+    settings.CELERY_TASKLOG_STATSD_ADDRESS = "127.0.0.1:%d" % receiver.getsockname()[1]
+    settings.CELERY_TASKLOG_METRICS = "statsd"
+
+    metrics.increment("lines_dropped_total", reason="quota")
+    metrics.add("sse_connections", -1)
+    metrics.observe("publish_seconds", 0.0125, transport="stream")
+    packets = [receiver.recv(512).decode() for _ in range(3)]
+    receiver.close()
+
+    assert packets == [
+        "celery_tasklog.lines_dropped_total.quota:1|c",
+        "celery_tasklog.sse_connections:-1|g",
+        "celery_tasklog.publish_seconds.stream:12.5|ms",
+    ]
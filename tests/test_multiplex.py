@@ -0,0 +1,103 @@
+import json
+
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import RequestFactory
+from rest_framework.test import APIClient
+
+from celery_tasklog.api_views import tasks_log_stream
+from celery_tasklog.buffers import save_log_lines
+from celery_tasklog.models import TaskLogLine
+from tests.test_log_stream import parse_frames
+
+
+def save_lines(task_id, *messages):
+    return save_log_lines([TaskLogLine(task_id=task_id, stream="stdout", message=m) for m in messages])
+
+
+def read_tasks(params, count, during=None):
+    """Collect ``count`` non-keepalive events (and their frames) from the multi-task view.
+
+    ``during(events)`` is awaited once after every chunk while it returns
+    something truthy, to change the subscription or write lines.
+    """
+
+    async def collect():
+        response = await tasks_log_stream(RequestFactory().get("/tasklog/sse/tasks/", params))
+        events, frames = [], []
+        stream = response.streaming_content
+        try:
+            async for chunk in stream:
+                for fields, data in parse_frames(chunk):
+                    frames.append(fields)
+                    for message in data if isinstance(data, list) else [data]:
+                        if message["type"] != "keepalive":
+                            events.append(message)
+                if during:
+                    await during(events)
+                if len(events) >= count:
+                    break
+        finally:
+            await stream.aclose()
+        return events, frames
+
+    return async_to_sync(collect)()
+
+
+def control(session, **change):
+    return APIClient().post(f"/tasklog/api/streams/{session}/", change, format="json")
+
+
+@pytest.mark.django_db
+def test_multiplexed_stream_tags_lines_and_changes_subscriptions():
+    save_lines("mux-a", "a1", "a2")
+    save_lines("mux-b", "b1")
+    steps = []
+
+    async def during(events):
+        if len(steps) == 0 and len(events) == 3:
+            # connected + the tail of both tasks
+            steps.append("add")
+            response = await sync_to_async(control)(events[0]["session"], add=["mux-c"], remove=["mux-a"])
+            assert response.status_code == 202
+        elif len(steps) == 1 and events[-1]["type"] == "subscriptions":
+            steps.append("write")
+            await sync_to_async(save_lines)("mux-a", "a3")
+            await sync_to_async(save_lines)("mux-c", "c1")
+
+    events, frames = read_tasks({"ids": "mux-a,mux-b", "tail": 1}, 5, during=during)
+
+    assert events[0]["type"] == "connected"
+    assert events[0]["task_ids"] == ["mux-a", "mux-b"]
+    assert sorted((e["task_id"], e["message"]) for e in events[1:3]) == [("mux-a", "a2"), ("mux-b", "b1")]
+    assert events[3] == {
+        "type": "subscriptions", "added": ["mux-c"], "removed": ["mux-a"], "task_ids": ["mux-b", "mux-c"]
+    }
+    assert (events[4]["task_id"], events[4]["message"]) == ("mux-c", "c1")
+    assert all("id" not in fields for fields in frames)
+
+
+@pytest.mark.django_db
+def test_multiplexed_stream_follows_running_tasks():
+    from django_celery_results.models import TaskResult
+
+    TaskResult.objects.create(task_id="mux-running", task_name="demo", status="STARTED")
+    TaskResult.objects.create(task_id="mux-done", task_name="demo", status="SUCCESS")
+    save_lines("mux-running", "busy")
+    save_lines("mux-done", "finished")
+
+    events, _ = read_tasks({"running": "1"}, 2)
+    assert events[0]["task_ids"] == ["mux-running"]
+    assert events[1]["message"] == "busy"
+
+
+def test_parse_task_ids_and_validation():
+    from celery_tasklog.multiplex import parse_task_ids
+
+    assert parse_task_ids("a, b:12,,c:d") == {"a": 0, "b": 12, "c:d": 0}
+    assert async_to_sync(tasks_log_stream)(RequestFactory().get("/tasklog/sse/tasks/")).status_code == 400
+
+
+def test_control_without_open_stream_is_404():
+    assert control("nobody", add=["x"]).status_code == 404
+    assert control("nobody", add="x").status_code == 400
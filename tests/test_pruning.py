@@ -0,0 +1,87 @@
+import sys
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from celery_tasklog.models import TaskLogLine, TaskLogSegment, TaskLogSummary
+from celery_tasklog.pruning import prune_expired, trim_tasks
+from celery_tasklog.summaries import refresh_summaries
+from celery_tasklog.tasks import capture_output
+
+
+def add_lines(task_id, count, age_days=0):
+    TaskLogLine.objects.bulk_create(
+        TaskLogLine(task_id=task_id, stream="stdout", message=f"line {i}") for i in range(count)
+    )
+    if age_days:
+        TaskLogLine.objects.filter(task_id=task_id).update(
+            timestamp=timezone.now() - timedelta(days=age_days)
+        )
+    refresh_summaries([task_id])
+
+
+@pytest.mark.django_db
+def test_prune_expired_deletes_old_lines_in_batches():
+    add_lines("old", 7, age_days=40)
+    add_lines("new", 3)
+
+    result = prune_expired(retention_days=30, batch_size=3)
+
+    assert result.deleted == 7
+    assert result.batches == 3
+    assert list(TaskLogLine.objects.order_by().values_list("task_id", flat=True).distinct()) == ["new"]
+
+
+@pytest.mark.django_db
+def test_trim_tasks_keeps_newest_lines(settings):
+    add_lines("long", 10)
+    add_lines("short", 2)
+
+    result = trim_tasks(max_lines=4, batch_size=2)
+
+    assert result.deleted == 6
+    messages = list(TaskLogLine.objects.filter(task_id="long").values_list("message", flat=True))
+    assert messages == ["line 6", "line 7", "line 8", "line 9"]
+    assert TaskLogLine.objects.filter(task_id="short").count() == 2
+
+    settings.CELERY_TASKLOG_STORAGE = "segments"
+    settings.CELERY_TASKLOG_SEGMENT_LINES = 3
+    with capture_output("segmented", batch_size=100):
+        for i in range(10):
+            print(f"line {i}")
+    trim_tasks(max_lines=4)
+    assert list(TaskLogSegment.objects.filter(task_id="segmented").values_list("first_line", flat=True)) == [7, 10]
+
+
+@pytest.mark.django_db
+def test_prune_command_reports_rate():
+    add_lines("old", 2, age_days=100)
+    from io import StringIO
+
+    out = StringIO()
+    call_command("prune_tasklogs", "--retention-days", "30", stdout=out)
+    assert "deleted 2 rows" in out.getvalue()
+    assert "rows/sec" in out.getvalue()
+    assert not TaskLogLine.objects.exists()
+
+
+@pytest.mark.django_db
+def test_summaries_follow_writes_and_pruning():
+    with capture_output("summary", batch_size=4):
+        for i in range(10):
+            print(f"line {i}")
+        print("oops", file=sys.stderr)
+
+    summary = TaskLogSummary.objects.get(task_id="summary")
+    assert (summary.line_count, summary.stdout_count, summary.stderr_count) == (11, 10, 1)
+    assert summary.bytes == sum(len(m) for m in TaskLogLine.objects.values_list("message", flat=True))
+
+    trim_tasks(max_lines=4)
+    summary.refresh_from_db()
+    assert (summary.line_count, summary.stdout_count, summary.stderr_count) == (4, 3, 1)
+
+    add_lines("old", 3, age_days=40)
+    prune_expired(retention_days=30)
+    assert list(TaskLogSummary.objects.values_list("task_id", flat=True)) == ["summary"]
@@ -0,0 +1,61 @@
+import sys
+
+import pytest
+from asgiref.sync import async_to_sync
+from rest_framework.test import APIClient
+
+from celery_tasklog.models import TaskLogLine, TaskLogSegment
+from celery_tasklog.sse import backfill
+from celery_tasklog.storage import SegmentStorage
+from celery_tasklog.tasks import capture_output
+
+
+@pytest.fixture
+def segments(settings):
+    settings.CELERY_TASKLOG_STORAGE = "segments"
+    settings.CELERY_TASKLOG_SEGMENT_LINES = 4
+
+
+@pytest.mark.django_db
+def test_segments_pack_lines_and_top_up_last_segment(segments):
+    task_id = "segment-test"
+    with capture_output(task_id, batch_size=3):
+        for i in range(9):
+            print(f"line {i}")
+        print("oops", file=sys.stderr)
+
+    assert not TaskLogLine.objects.filter(task_id=task_id).exists()
+    rows = list(TaskLogSegment.objects.filter(task_id=task_id).values_list("first_line", "last_line"))
+    assert rows == [(1, 4), (5, 8), (9, 10)]
+
+    lines = SegmentStorage().lines(task_id)
+    assert [line.id for line in lines] == list(range(1, 11))
+    assert [line.message for line in lines][:2] == ["line 0", "line 1"]
+    assert lines[-1].stream == "stderr"
+    assert [line.message for line in SegmentStorage().lines(task_id, after=3, before=6)] == ["line 3", "line 4"]
+    newest = SegmentStorage().lines(task_id, limit=2, reverse=True)
+    assert [line.id for line in newest] == [10, 9]
+    assert [line.id for line in SegmentStorage().lines(task_id, stream="stderr")] == [10]
+
+
+@pytest.mark.django_db
+def test_segments_are_read_transparently(segments, settings):
+    settings.CELERY_TASKLOG_BACKFILL_CHUNK_SIZE = 3
+    task_id = "segment-read-test"
+    with capture_output(task_id, batch_size=100):
+        for i in range(6):
+            print(f"line {i}")
+
+    async def collect():
+        return [m["message"] async for m in backfill(task_id, after=2)]
+
+    assert async_to_sync(collect)() == ["line 2", "line 3", "line 4", "line 5"]
+
+    page = APIClient().get(f"/tasklog/api/tasks/{task_id}/logs/", {"limit": 2}).json()
+    assert [log["message"] for log in page["results"]] == ["line 4", "line 5"]
+    assert [log["id"] for log in page["results"]] == [5, 6]
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        SegmentStorage(codec="lz4")
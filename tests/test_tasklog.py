@@ -1,28 +1,6 @@
 import sys
-import os
-import pathlib
 import pytest
 
-# Ensure the package src directory is on the Python path when tests run
-ROOT = pathlib.Path(__file__).resolve().parents[1]
-BASE_PATH = str(ROOT / "celery_tasklog")
-sys.path.insert(0, BASE_PATH)
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djproject.settings")
-import django
-from django.conf import settings
-
-settings.DATABASES["default"] = {
-    "ENGINE": "django.db.backends.sqlite3",
-    "NAME": ":memory:",
-}
-
-django.setup()
-
-import importlib
-
-celery_pkg = importlib.import_module("src.celery_tasklog")
-sys.modules["celery_tasklog"] = celery_pkg
-
 from celery_tasklog.tasks import capture_output, TerminalLoggingTask
 from celery_tasklog.models import TaskLogLine
 
@@ -58,3 +36,298 @@ def test_terminal_logging_task_records_output():
 
     messages = list(TaskLogLine.objects.filter(task_id="task-001").values_list("message", flat=True))
     assert "adding 2 and 3" in messages[0]
+
+
+@pytest.mark.django_db
+def test_buffered_capture_uses_bulk_inserts(django_assert_max_num_queries):
+    task_id = "batched-test"
+    with django_assert_max_num_queries(10) as queries:
+        with capture_output(task_id, batch_size=50, flush_interval=60000):
+            for i in range(60):
+                print(f"line {i}")
+            print("oops", file=sys.stderr)
+
+    line_inserts = [q for q in queries.captured_queries if q["sql"].startswith('INSERT INTO "celery_tasklog_tasklogline"')]
+    assert len(line_inserts) == 2
+
+    logs = list(TaskLogLine.objects.filter(task_id=task_id).order_by("id"))
+    assert len(logs) == 61
+    assert [log.message for log in logs[:2]] == ["line 0", "line 1"]
+    assert logs[-1].stream == "stderr"
+
+
+@pytest.mark.django_db
+def test_log_buffer_flushes_after_interval():
+    from celery_tasklog.buffers import LogBuffer
+
+    log_buffer = LogBuffer(batch_size=1000, flush_interval=0)
+    log_buffer.add(TaskLogLine(task_id="interval-test", stream="stdout", message="now"))
+    assert not log_buffer.pending
+    assert TaskLogLine.objects.filter(task_id="interval-test").count() == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_background_capture_drains_at_exit():
+    task_id = "background-test"
+    with capture_output(task_id, batch_size=25, flush_interval=60000, background=True):
+        for i in range(100):
+            print(f"line {i}")
+
+    messages = list(TaskLogLine.objects.filter(task_id=task_id).values_list("message", flat=True))
+    assert messages == [f"line {i}" for i in range(100)]
+
+
+def test_background_buffer_drop_policies():
+    from celery_tasklog.buffers import BackgroundLogBuffer
+
+    for policy, expected in (("drop", ["0", "1"]), ("drop_oldest", ["3", "4"])):
+        log_buffer = BackgroundLogBuffer(batch_size=10, flush_interval=60000, max_queue=2, policy=policy)
+        # Hold the condition so the writer thread cannot drain the queue.
+        with log_buffer._cond:
+            for i in range(5):
+                log_buffer.add(TaskLogLine(task_id="drop-test", stream="stdout", message=str(i)))
+            assert [line.message for line in log_buffer._queue] == expected
+        assert log_buffer.dropped == 3
+        log_buffer._queue.clear()
+        log_buffer._unfinished = 0
+        log_buffer.close()
+
+    with pytest.raises(ValueError):
+        BackgroundLogBuffer(policy="explode")
+
+
+@pytest.mark.django_db
+def test_flush_publishes_batch_with_one_pipeline(fake_redis, monkeypatch):
+    import json
+
+    pubsub = fake_redis.pubsub()
+    pubsub.subscribe("tasklog:publish-test")
+    pubsub.get_message(timeout=1)
+
+    executed = []
+    pipeline = fake_redis.pipeline
+
+    def counting_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        original_execute = pipe.execute
+        pipe.execute = lambda: executed.append(len(pipe.command_stack)) or original_execute()
+        return pipe
+
+    monkeypatch.setattr(fake_redis, "pipeline", counting_pipeline)
+    with capture_output("publish-test", batch_size=10, flush_interval=60000):
+        for i in range(10):
+            print(f"line {i}")
+
+    assert executed == [10]
+    messages = []
+    while True:
+        message = pubsub.get_message(timeout=0.1)
+        if message is None:
+            break
+        messages.append(json.loads(message["data"]))
+    assert [m["message"] for m in messages] == [f"line {i}" for i in range(10)]
+    ids = TaskLogLine.objects.filter(task_id="publish-test").values_list("id", flat=True)
+    assert [m["id"] for m in messages] == list(ids)
+
+
+@pytest.mark.django_db
+def test_task_lifecycle_publishes_status_events(fake_redis):
+    import json
+
+    from celery import shared_task
+
+    @shared_task(base=TerminalLoggingTask, bind=True, name="status-sample")
+    def status_sample(self, fail=False):
+        print("working")
+        self.update_state(state="PROGRESS", meta={"progress": 50})
+        if fail:
+            raise ValueError("boom")
+        return "done"
+
+    pubsub = fake_redis.pubsub()
+    pubsub.psubscribe("tasklog:status-*")
+    pubsub.get_message(timeout=1)
+
+    status_sample.apply(task_id="status-ok")
+    status_sample.apply(kwargs={"fail": True}, task_id="status-fail")
+
+    messages = []
+    while (message := pubsub.get_message(timeout=0.1)) is not None:
+        messages.append(json.loads(message["data"]))
+    events = [(m["task_id"], m["type"], m.get("status"), m.get("progress")) for m in messages]
+    assert events == [
+        ("status-ok", "status", "STARTED", None),
+        ("status-ok", "new_log", None, None),
+        ("status-ok", "status", "PROGRESS", 50),
+        ("status-ok", "status", "SUCCESS", None),
+        ("status-fail", "status", "STARTED", None),
+        ("status-fail", "new_log", None, None),
+        ("status-fail", "status", "PROGRESS", 50),
+        ("status-fail", "status", "FAILURE", None),
+    ]
+    assert messages[-1]["error"] == "ValueError: boom"
+
+
+@pytest.mark.django_db
+def test_logging_records_are_captured_as_structured_lines():
+    import logging
+
+    logger = logging.getLogger("tasklog.sample")
+    logger.warning("outside capture")
+    with capture_output("logging-test"):
+        print("before")
+        logger.error("failed %s", "step", extra={"step": 3, "obj": object()})
+        print("after")
+
+    logs = list(TaskLogLine.objects.filter(task_id="logging-test").order_by("id"))
+    assert [log.stream for log in logs] == ["stdout", "log", "stdout"]
+    record = logs[1]
+    assert record.message == "failed step"
+    assert record.level == logging.ERROR
+    assert record.logger == "tasklog.sample"
+    assert record.extra["step"] == 3
+    assert record.extra["obj"].startswith("<object object")
+    assert logs[0].level is None
+
+
+@pytest.mark.django_db
+def test_segment_storage_keeps_structured_fields(settings):
+    settings.CELERY_TASKLOG_STORAGE = "segments"
+    from celery_tasklog.storage import get_storage
+
+    storage = get_storage()
+    storage.save([
+        TaskLogLine(task_id="segment-log", stream="stdout", message="plain"),
+        TaskLogLine(task_id="segment-log", stream="log", message="boom", level=40, logger="app", extra={"k": 1}),
+    ])
+    plain, record = storage.lines("segment-log")
+    assert plain.level is None and plain.message == "plain"
+    assert (record.level, record.logger, record.extra) == (40, "app", {"k": 1})
+    assert [line.message for line in storage.lines("segment-log", min_level=30)] == ["boom"]
+
+
+class ListBuffer:
+    def __init__(self):
+        self.lines = []
+
+    def add(self, line):
+        self.lines.append(line)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_writer_splits_lines_and_collapses_progress_redraws():
+    from celery_tasklog.tasks import DBLogWriter
+
+    sink = ListBuffer()
+    writer = DBLogWriter("writer-test", "stdout", sink)
+    writer.write("first\nsec")
+    writer.write("ond\r\n\nthird")
+    writer.flush()
+    for percent in range(0, 101, 25):
+        writer.write(f"\rprogress {percent}%")
+        writer.flush()
+    writer.write("\r")
+    writer.write("\ndone\r\n")
+    writer.write("partial")
+    writer.close()
+
+    assert [line.message for line in sink.lines] == [
+        "first", "second", "third", "progress 100%", "done", "partial",
+    ]
+
+
+def test_limits_truncate_lines_and_drop_over_quota():
+    from celery_tasklog.buffers import LimitedLogBuffer
+    from celery_tasklog.tasks import DBLogWriter
+
+    sink = ListBuffer()
+    limited = LimitedLogBuffer(sink, "limits-test", max_line_length=10, max_bytes=70)
+    writer = DBLogWriter("limits-test", "stdout", limited)
+    for _ in range(1000):
+        writer.write("x" * 1000)
+    assert writer._length == 10
+    writer.write("\nshort\n")
+    for i in range(10):
+        writer.write(f"line {i}\n")
+    writer.close()
+    limited.close()
+
+    messages = [line.message for line in sink.lines]
+    assert messages[:2] == ["x" * 10 + " [truncated 999990 characters]", "short"]
+    assert messages[2:6] == ["line 0", "line 1", "line 2", "line 3"]
+    notice, summary = sink.lines[6:]
+    assert notice.stream == "log" and notice.extra == {"max_bytes": 70}
+    assert summary.extra == {
+        "truncated_lines": 1, "truncated_chars": 999990, "dropped_lines": 6, "dropped_bytes": 36,
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+def test_fd_capture_records_subprocess_and_c_output():
+    import ctypes
+    import os
+    import subprocess
+
+    task_id = "fd-capture-test"
+    with capture_output(task_id, capture_fds=True):
+        print("from python")
+        os.write(1, b"from os.write\n")
+        subprocess.run(["sh", "-c", "echo from child; echo child error >&2"], check=True)
+        ctypes.CDLL(None).printf(b"from C\n")
+
+    logs = TaskLogLine.objects.filter(task_id=task_id)
+    assert set(logs.values_list("stream", "message")) == {
+        ("stdout", "from python"),
+        ("stdout", "from os.write"),
+        ("stdout", "from child"),
+        ("stderr", "child error"),
+        ("stdout", "from C"),
+    }
+
+
+@pytest.fixture
+def context_streams(settings):
+    settings.CELERY_TASKLOG_CONTEXT_STREAMS = True
+    stdout, stderr = sys.stdout, sys.stderr
+    yield
+    sys.stdout, sys.stderr = stdout, stderr
+
+
+@pytest.mark.django_db(transaction=True)
+def test_context_streams_route_concurrent_tasks(context_streams):
+    import threading
+
+    from django.db import connection
+
+    from celery_tasklog.streams import TaskStream
+
+    barrier = threading.Barrier(2)
+
+    def task(task_id):
+        try:
+            with capture_output(task_id):
+                for i in range(5):
+                    # Both tasks print between the same barriers.
+                    barrier.wait()
+                    print(f"{task_id} line {i}")
+                    print(f"{task_id} error {i}", file=sys.stderr)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=task, args=(f"thread-{n}",)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert isinstance(sys.stdout, TaskStream) and isinstance(sys.stderr, TaskStream)
+    for task_id in ("thread-0", "thread-1"):
+        logs = list(TaskLogLine.objects.filter(task_id=task_id).order_by("id").values_list("stream", "message"))
+        assert logs == [
+            line for i in range(5) for line in (("stdout", f"{task_id} line {i}"), ("stderr", f"{task_id} error {i}"))
+        ]